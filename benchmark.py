@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+#     Copyright 2016 Stephen Sinclair
+
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may not
+#     use this file except in compliance with the License. You may obtain a copy
+#     of the License at
+
+#         http://www.apache.org/licenses/LICENSE-2.0
+
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+
+# Generate a synthetic SrcML archive, run srcml-to-mse.py on it and
+# report the time, memory and throughput of each phase.  Results are
+# saved as JSON so that runs can be compared with --compare.
+
+from xml.sax.saxutils import escape, quoteattr
+import sys, os, bz2, argparse, json, random, shutil, subprocess, tempfile
+import time, platform
+
+here = os.path.dirname(os.path.abspath(__file__))
+converter = os.path.join(here, 'srcml-to-mse.py')
+
+# Which count gives the throughput of each phase
+phase_items = [('load', 'units'),
+               ('units', 'units'),
+               ('includes', 'includes'),
+               ('classes', 'classes'),
+               ('functions', 'functions'),
+               ('types', 'types'),
+               ('calls', 'calls'),
+               ('output', 'nodes')]
+
+unit_start = ('<unit xmlns:cpp="http://www.srcML.org/srcML/cpp" '
+              'revision="0.9.5" language="C++" filename=%s>\n')
+
+def name(n):
+    return '<name>%s</name>'%escape(n)
+
+def type_(n):
+    return '<type>%s</type>'%name(n)
+
+def params(types):
+    return '<parameter_list>(%s)</parameter_list>'%', '.join(
+        '<param><decl>%s <name>p%d</name></decl></param>'%(type_(t), i)
+        for i, t in enumerate(types))
+
+def call(n, nargs):
+    return ('<expr_stmt><expr><call>%s<argument_list>(%s)</argument_list>'
+            '</call></expr>;</expr_stmt>'
+            %(name(n), ', '.join('<argument><expr><literal type="number">'
+                                 '%d</literal></expr></argument>'%i
+                                 for i in range(nargs))))
+
+def include(path, angled=False):
+    path = '<%s>'%path if angled else '"%s"'%path
+    return ('<cpp:include>#<cpp:directive>include</cpp:directive> '
+            '<cpp:file>%s</cpp:file></cpp:include>\n'%escape(path))
+
+class Corpus(object):
+    """A synthetic code base: pairs of headers declaring classes and
+    sources defining their methods and some free functions, all making
+    calls to each other."""
+
+    def __init__(self, units=1000, classes=3, methods=8, calls=4,
+                 includes=5, seed=0):
+        self.units = units
+        self.classes = classes
+        self.methods = methods
+        self.calls = calls
+        self.includes = includes
+        self.rng = random.Random(seed)
+        self.n_pairs = max(1, units//2)
+
+    def header_path(self, i):
+        return 'inc/mod%d/header%d.hpp'%(i%10, i)
+
+    def class_name(self, i, j):
+        return 'Class%d_%d'%(i, j)
+
+    def method_types(self, k):
+        # Every fourth method overloads the one before it
+        return ['int']*(1 + k%4//3)
+
+    def method_name(self, k):
+        return 'method%d'%(k - k%4//3)
+
+    def callee(self):
+        i = self.rng.randrange(self.n_pairs)
+        if self.rng.random() < 0.5:
+            return 'function%d_%d'%(i, self.rng.randrange(self.methods)), 1
+        k = self.rng.randrange(self.methods)
+        return self.method_name(k), len(self.method_types(k))
+
+    def body(self):
+        return '<block>{\n%s\n}</block>'%'\n'.join(
+            call(*self.callee()) for c in range(self.calls))
+
+    def header(self, i):
+        out = [unit_start%quoteattr(self.header_path(i))]
+        for j in range(self.classes):
+            out.append('<class>class %s'%name(self.class_name(i, j)))
+            if i > 0:
+                out.append(' <super>: <specifier>public</specifier> %s'
+                           '</super>'%name(self.class_name(i-1, j)))
+            out.append('\n<block>{<private type="default">\n')
+            out.append('<decl_stmt><decl>%s %s</decl>;</decl_stmt>\n'
+                       %(type_('int'), name('count')))
+            out.append('<decl_stmt><decl>%s %s</decl>;</decl_stmt>\n'
+                       %(type_(self.class_name(self.rng.randrange(
+                           self.n_pairs), j)), name('other')))
+            out.append('</private><public>public:\n')
+            for k in range(self.methods):
+                out.append('<function_decl>%s %s%s;</function_decl>\n'
+                           %(type_('void'), name(self.method_name(k)),
+                             params(self.method_types(k))))
+            out.append('</public>}</block>;</class>\n')
+        out.append('</unit>\n')
+        return ''.join(out)
+
+    def source(self, i):
+        out = [unit_start%quoteattr('src/mod%d/source%d.cpp'%(i%10, i))]
+        out.append(include('mod%d/header%d.hpp'%(i%10, i)))
+        for n in range(self.includes - 1):
+            if n%3 == 2:
+                out.append(include('vector', angled=True))
+            else:
+                h = self.rng.randrange(self.n_pairs)
+                out.append(include('mod%d/header%d.hpp'%(h%10, h)))
+        for j in range(self.classes):
+            for k in range(self.methods):
+                out.append('<function>%s <name>%s<operator>::</operator>%s'
+                           '</name>%s\n%s</function>\n'
+                           %(type_('void'), name(self.class_name(i, j)),
+                             name(self.method_name(k)),
+                             params(self.method_types(k)), self.body()))
+        for k in range(self.methods):
+            out.append('<function>%s %s%s\n%s</function>\n'
+                       %(type_('int'), name('function%d_%d'%(i, k)),
+                         params(['int']), self.body()))
+        out.append('</unit>\n')
+        return ''.join(out)
+
+    def write(self, filename):
+        opener = bz2.BZ2File if filename.endswith('.bz2') else open
+        with opener(filename, 'wb') as f:
+            f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    b'<unit xmlns="http://www.srcML.org/srcML/src" '
+                    b'revision="0.9.5">\n\n')
+            for i in range(self.n_pairs):
+                f.write(self.header(i).encode('UTF-8'))
+                f.write(self.source(i).encode('UTF-8'))
+            f.write(b'</unit>\n')
+
+def run(corpus_file, stats_file, args):
+    """Convert the corpus once, returning the wall time and the
+    converter's phase statistics."""
+    start = time.time()
+    subprocess.check_call([sys.executable, converter, corpus_file,
+                           '--stats', stats_file] + args,
+                          stdout=subprocess.DEVNULL)
+    wall = time.time() - start
+    with open(stats_file) as f:
+        return wall, json.load(f)
+
+def summarize(runs):
+    """Best time of each phase over several runs, with its throughput."""
+    counts = runs[0][1]['counts']
+    phases = {}
+    for phase, items in phase_items:
+        times = [r[1]['phases'][phase]['seconds'] for r in runs
+                 if phase in r[1]['phases']]
+        if not times:
+            continue
+        seconds = min(times)
+        n = counts.get(items, 0)
+        if phase == 'includes':
+            n += counts.get('unresolved_includes', 0)
+        phases[phase] = {
+            'seconds': seconds,
+            'peak_rss': max(r[1]['phases'][phase]['peak_rss'] or 0
+                            for r in runs),
+            'items': items,
+            'count': n,
+            'per_second': n/seconds if seconds > 0 else None}
+    wall = min(r[0] for r in runs)
+    return {'wall_seconds': wall,
+            'peak_rss': max(p['peak_rss'] for p in phases.values()),
+            'units_per_second': counts.get('units', 0)/wall,
+            'calls_per_second': counts.get('calls', 0)/wall,
+            'phases': phases,
+            'counts': counts}
+
+def report(result, previous=None):
+    def mb(n):
+        return '%.1f'%(n/1048576.0) if n else '-'
+    print('%-10s %10s %12s %14s %10s'%('phase', 'seconds', 'peak MB',
+                                       'items/s', 'change'))
+    for phase, items in phase_items:
+        p = result['phases'].get(phase)
+        if p is None:
+            continue
+        change = ''
+        if previous is not None and phase in previous['phases']:
+            old = previous['phases'][phase]['seconds']
+            if old > 0:
+                change = '%+.1f%%'%(100.0*(p['seconds'] - old)/old)
+        rate = '%.0f %s'%(p['per_second'], items) if p['per_second'] else '-'
+        print('%-10s %10.3f %12s %14s %10s'%(phase, p['seconds'],
+                                             mb(p['peak_rss']), rate, change))
+    print('Total %.3f s, %.0f units/s, %.0f calls/s, peak %s MB'
+          %(result['wall_seconds'], result['units_per_second'],
+            result['calls_per_second'], mb(result['peak_rss'])))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark srcml-to-mse.py on a synthetic SrcML corpus.')
+    parser.add_argument('--units', type=int, default=1000,
+                        help='number of units (half headers, half sources)')
+    parser.add_argument('--classes', type=int, default=3,
+                        help='classes per header')
+    parser.add_argument('--methods', type=int, default=8,
+                        help='methods per class and functions per source')
+    parser.add_argument('--calls', type=int, default=4,
+                        help='calls in each function body')
+    parser.add_argument('--includes', type=int, default=5,
+                        help='includes per source')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bz2', action='store_true',
+                        help='compress the corpus with bzip2')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs to make, the best time is kept')
+    parser.add_argument('--output', metavar='FILE',
+                        help='save the results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('--keep', metavar='DIR',
+                        help='write the corpus and outputs to DIR and keep '
+                        'them')
+    parser.add_argument('converter_args', nargs=argparse.REMAINDER,
+                        help='options passed to srcml-to-mse.py after "--"')
+    args = parser.parse_args()
+
+    converter_args = args.converter_args
+    if converter_args[:1] == ['--']:
+        converter_args = converter_args[1:]
+
+    workdir = args.keep or tempfile.mkdtemp(prefix='srcml-bench-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    try:
+        corpus = Corpus(args.units, args.classes, args.methods, args.calls,
+                        args.includes, args.seed)
+        corpus_file = os.path.join(workdir, 'corpus.xml'
+                                   + ('.bz2' if args.bz2 else ''))
+        print('Generating', corpus_file, '...')
+        corpus.write(corpus_file)
+        stats_file = os.path.join(workdir, 'stats.json')
+        runs = [run(corpus_file, stats_file, converter_args)
+                for i in range(args.repeat)]
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir)
+
+    result = summarize(runs)
+    result['config'] = {'units': args.units, 'classes': args.classes,
+                        'methods': args.methods, 'calls': args.calls,
+                        'includes': args.includes, 'seed': args.seed,
+                        'bz2': args.bz2, 'repeat': args.repeat,
+                        'converter_args': converter_args}
+    result['python'] = platform.python_version()
+    result['date'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    report(result, previous)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
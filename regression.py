@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+
+#     Copyright 2016 Stephen Sinclair
+
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may not
+#     use this file except in compliance with the License. You may obtain a copy
+#     of the License at
+
+#         http://www.apache.org/licenses/LICENSE-2.0
+
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+
+# Check that srcml-to-mse.py still makes the same models.  Each fixture
+# listed in fixtures/fixtures.json is converted and compared with its
+# golden MSE output and entity counts, whatever the order and ids of
+# the nodes.  Then the synthetic corpus of benchmark.py is converted and
+# the time of each phase checked against fixtures/timing.json.  With
+# --update, the current outputs become the golden ones.
+#
+# Besides "input" and "args", a fixture can give:
+#   "golden"    the name of the golden output it shares with another
+#   "runs"      how many times to convert it, each output being checked,
+#               to convert with a cache and then from it
+#   "set"       attributes of srcml_to_mse classes to set first, such as
+#               {"NodeBuffer.check_interval": 512}
+#   "old"       a fixture copied as the earlier snapshot for --diff
+#   "old_args"  arguments to convert "old" with first, to make a store
+# "{scratch}" in the arguments is a directory of the fixture outside
+# the one it is converted in, and "{old}" the copy of "old".  SQLite,
+# columnar and JSON lines outputs are read back and compared with the
+# golden MSE output, and --diff outputs with a golden .diff.jsonl file.
+
+import sys, os, re, bz2, json, argparse, collections, shutil, subprocess
+import sqlite3, tempfile
+
+import benchmark, srcml_to_mse
+
+here = os.path.dirname(os.path.abspath(__file__))
+fixtures_dir = os.path.join(here, 'fixtures')
+golden_dir = os.path.join(fixtures_dir, 'golden')
+
+mse_node = re.compile(r"\(([\w.]+) \(id: (\d+)\)")
+mse_attr = re.compile(r"\((\w+) (\(ref: (\d+)\)|'(?:[^']|'')*'|[^()\s]+)\)")
+
+def read_mse(filename):
+    """The nodes of an MSE file as {id: (type, attributes)}, where an
+    attribute referring to another node has the value ('ref', id)."""
+    opener = bz2.BZ2File if filename.endswith('.bz2') else open
+    with opener(filename, 'rb') as f:
+        data = f.read().decode('UTF-8')
+    headers = list(mse_node.finditer(data))
+    nodes = {}
+    for i, m in enumerate(headers):
+        end = headers[i+1].start() if i + 1 < len(headers) else len(data)
+        attrs = []
+        for a in mse_attr.finditer(data, m.end(), end):
+            if a.group(3) is not None:
+                attrs.append((a.group(1), ('ref', a.group(3))))
+            else:
+                attrs.append((a.group(1), a.group(2)))
+        nodes[m.group(2)] = (m.group(1), attrs)
+    return nodes
+
+def canonical(nodes):
+    """The nodes of a model as a multiset of labels made of their type,
+    their attributes and the labels of the nodes they refer to, which do
+    not depend on the ids.  The sourceAnchor of an element is left out,
+    since its FileAnchor refers back to the element."""
+    labels = {}
+    def label(i):
+        l = labels.get(i)
+        if l is None:
+            if i not in nodes:
+                return '(missing %s)'%i
+            kind, attrs = nodes[i]
+            parts = []
+            for name, v in attrs:
+                if name == 'sourceAnchor':
+                    continue
+                if isinstance(v, tuple):
+                    v = label(v[1])
+                parts.append('%s=%s'%(name, v))
+            l = labels[i] = '%s(%s)'%(kind, ', '.join(parts))
+        return l
+    return collections.Counter(label(i) for i in nodes)
+
+def project(nodes):
+    """The nodes of a model as the SQLite and columnar outputs keep
+    them, with only the attributes that have a column."""
+    result = {}
+    for i, (kind, attrs) in nodes.items():
+        table = srcml_to_mse.node_tables.get(kind)
+        if table is not None:
+            values = dict(attrs)
+            result[i] = (kind, [(name, values[name]) for name, k in table[1]
+                                if name in values])
+    return result
+
+def mse_value(v, kind):
+    """A value read back from a table as read_mse() gives it."""
+    if kind == 'ref':
+        return ('ref', str(v))
+    if kind == 'str':
+        return srcml_to_mse.mseString(v)
+    if kind == 'bool':
+        return srcml_to_mse.mseBoolean(v)
+    return str(v)
+
+def read_tables(tables):
+    """The nodes of a model given as {table: {column: values}}, in the
+    form read_mse() gives."""
+    types = dict((table, (kind, columns)) for kind, (table, columns)
+                 in srcml_to_mse.node_tables.items())
+    nodes = {}
+    for table, values in tables.items():
+        kind, columns = types[table]
+        for row, i in enumerate(values['id']):
+            nodes[str(i)] = (kind, [(name, mse_value(values[name][row], k))
+                                    for name, k in columns
+                                    if values[name][row] is not None])
+    return nodes
+
+def read_sqlite(filename):
+    db = sqlite3.connect(filename)
+    tables = {}
+    for kind, (table, columns) in srcml_to_mse.node_tables.items():
+        cursor = db.execute('SELECT * FROM %s'%table)
+        names = [d[0] for d in cursor.description]
+        rows = cursor.fetchall()
+        tables[table] = dict((name, [r[i] for r in rows])
+                             for i, name in enumerate(names))
+    db.close()
+    return read_tables(tables)
+
+def read_columnar(filename):
+    return read_tables(srcml_to_mse.read_columnar(filename))
+
+def read_jsonl(filename):
+    nodes = {}
+    for line in read_lines(filename):
+        record = json.loads(line)
+        table = srcml_to_mse.node_tables.get(record['type'])
+        if table is not None:
+            nodes[str(record['id'])] = (
+                record['type'], [(name, mse_value(record[name], k))
+                                 for name, k in table[1]
+                                 if record.get(name) is not None])
+    return nodes
+
+def read_lines(filename):
+    opener = bz2.BZ2File if filename.endswith('.bz2') else open
+    with opener(filename, 'rb') as f:
+        return f.read().decode('UTF-8').splitlines()
+
+# Outputs read back and compared with the golden MSE output
+readers = [('.jsonl', read_jsonl), ('.sqlite', read_sqlite),
+           ('.msecol', read_columnar)]
+
+def compare_nodes(new, old, limit=5):
+    """The differences between two models, ignoring node order."""
+    new = canonical(new)
+    old = canonical(old)
+    problems = []
+    for sign, diff in (('-', old - new), ('+', new - old)):
+        for i, (label, n) in enumerate(sorted(diff.items())):
+            if i == limit:
+                problems.append('%s ... %d more'%(sign, len(diff) - limit))
+                break
+            problems.append('%s %s%s'%(sign, label,
+                                       ' (x%d)'%n if n > 1 else ''))
+    return problems
+
+def compare_mse(output, golden, limit=5):
+    """The differences between two MSE files, ignoring node order."""
+    return compare_nodes(read_mse(output), read_mse(golden), limit)
+
+def compare_diff(output, golden, limit=5):
+    """The differences between two --diff outputs, whatever the order
+    of their records."""
+    new = collections.Counter(read_lines(output))
+    old = collections.Counter(read_lines(golden))
+    problems = []
+    for sign, diff in (('-', old - new), ('+', new - old)):
+        for i, line in enumerate(sorted(diff)):
+            if i == limit:
+                problems.append('%s ... %d more'%(sign, len(diff) - limit))
+                break
+            problems.append('%s %s'%(sign, line))
+    return problems
+
+def compare_counts(counts, golden):
+    return ['count of %s is %s, was %s'%(k, counts.get(k), golden.get(k))
+            for k in sorted(set(counts) | set(golden))
+            if counts.get(k) != golden.get(k)]
+
+# Runs the converter after setting the attributes given as JSON
+driver = ('import sys, json, srcml_to_mse\n'
+          'for name, value in json.loads(sys.argv[1]).items():\n'
+          '    cls, attr = name.split(".")\n'
+          '    setattr(getattr(srcml_to_mse, cls), attr, value)\n'
+          'sys.exit(srcml_to_mse.main(sys.argv[2:]))\n')
+
+def run_converter(fixture, args):
+    settings = fixture.get('set')
+    if settings:
+        path = os.environ.get('PYTHONPATH')
+        env = dict(os.environ, PYTHONPATH=here + (os.pathsep + path
+                                                  if path else ''))
+        command = [sys.executable, '-c', driver, json.dumps(settings)]
+    else:
+        env = None
+        command = [sys.executable, benchmark.converter]
+    subprocess.check_call(command + args, stdout=subprocess.DEVNULL,
+                          env=env)
+
+def convert(fixture, workdir):
+    """Convert a fixture in its own directory, yielding the output file
+    and the entity counts of each run."""
+    source = os.path.join(fixtures_dir, fixture['input'])
+    directory = os.path.join(workdir, fixture['name'])
+    scratch = directory + '.scratch'
+    os.makedirs(directory)
+    os.makedirs(scratch)
+    input = os.path.join(directory, os.path.basename(source))
+    shutil.copy(source, input)
+    old = None
+    if 'old' in fixture:
+        old = os.path.join(scratch, os.path.basename(fixture['old']))
+        shutil.copy(os.path.join(fixtures_dir, fixture['old']), old)
+    def expand(args):
+        return [a.replace('{scratch}', scratch).replace('{old}', old or '')
+                for a in args]
+    if 'old_args' in fixture:
+        run_converter(fixture, [old] + expand(fixture['old_args']))
+    for run in range(fixture.get('runs', 1)):
+        stats_file = os.path.join(scratch, 'stats%d.json'%run)
+        run_converter(fixture, [input, '--stats', stats_file]
+                      + expand(fixture.get('args', [])))
+        (output,) = [os.path.join(directory, f) for f in os.listdir(directory)
+                     if f != os.path.basename(input)]
+        with open(stats_file) as f:
+            yield output, json.load(f)['counts']
+
+def golden_output(fixture, output):
+    """The golden file an output is compared with, and how."""
+    name = os.path.join(golden_dir, fixture.get('golden', fixture['name']))
+    kind = output[:-len('.bz2')] if output.endswith('.bz2') else output
+    if kind.endswith('.diff.jsonl'):
+        return name + '.diff.jsonl', compare_diff
+    for suffix, reader in readers:
+        if kind.endswith(suffix):
+            golden = name + '.mse'
+            if not os.path.exists(golden):
+                golden += '.bz2'
+            return golden, lambda output, golden: compare_nodes(
+                project(reader(output)), project(read_mse(golden)))
+    suffix = '.mse.bz2' if output.endswith('.bz2') else '.mse'
+    return name + suffix, compare_mse
+
+def check_fixture(fixture, workdir, update=False):
+    golden_counts = os.path.join(golden_dir, fixture['name'] + '.counts.json')
+    runs = []
+    problems = []
+    for output, counts in convert(fixture, workdir):
+        golden, compare = golden_output(fixture, output)
+        runs.append(counts)
+        if update:
+            # Shared golden outputs are updated by their own fixture
+            if 'golden' not in fixture and compare in (compare_mse,
+                                                        compare_diff):
+                shutil.copy(output, golden)
+            continue
+        if not os.path.exists(golden):
+            return ['no golden output %s'%os.path.relpath(golden, here)]
+        problems += ['run %d: %s'%(len(runs), p) if 'runs' in fixture else p
+                     for p in compare(output, golden)]
+    counts = runs if 'runs' in fixture else runs[0]
+    if update:
+        with open(golden_counts, 'w') as f:
+            json.dump(counts, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return []
+    if not os.path.exists(golden_counts):
+        return problems + ['no golden counts %s'
+                           %os.path.relpath(golden_counts, here)]
+    with open(golden_counts) as f:
+        golden = json.load(f)
+    if 'runs' in fixture:
+        for i, (c, g) in enumerate(zip(counts, golden)):
+            problems += ['run %d: %s'%(i + 1, p) for p in compare_counts(c, g)]
+    else:
+        problems += compare_counts(counts, golden)
+    return problems
+
+def check_timing(workdir, factor=1.0):
+    """Convert the synthetic corpus and compare the time of each phase,
+    and the total as "total", with its limit in fixtures/timing.json."""
+    with open(os.path.join(fixtures_dir, 'timing.json')) as f:
+        timing = json.load(f)
+    corpus_file = os.path.join(workdir, 'corpus.xml')
+    benchmark.Corpus(**timing['corpus']).write(corpus_file)
+    stats_file = os.path.join(workdir, 'corpus.json')
+    result = benchmark.summarize([
+        benchmark.run(corpus_file, stats_file, timing.get('args', []))
+        for i in range(timing.get('repeat', 1))])
+    problems = []
+    for phase, limit in sorted(timing['max_seconds'].items()):
+        if phase == 'total':
+            seconds = result['wall_seconds']
+        else:
+            seconds = result['phases'][phase]['seconds']
+        limit *= factor
+        slow = seconds > limit
+        print('  %-10s %8.3f s, limit %8.3f s%s'%(phase, seconds, limit,
+                                                   '  SLOW' if slow else ''))
+        if slow:
+            problems.append('%s took %.3f s, limit %.3f s'
+                            %(phase, seconds, limit))
+    return problems
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare srcml-to-mse.py outputs with golden outputs '
+        'and check its speed.')
+    parser.add_argument('fixtures', nargs='*', metavar='NAME',
+                        help='fixtures to check, by default all of them')
+    parser.add_argument('--update', action='store_true',
+                        help='save the current outputs as golden outputs')
+    parser.add_argument('--no-timing', action='store_true',
+                        help='do not check the time taken on the corpus')
+    parser.add_argument('--timing-factor', type=float, default=1.0,
+                        metavar='F', help='multiply the time limits by F, '
+                        'for slower machines')
+    parser.add_argument('--keep', metavar='DIR',
+                        help='convert in DIR and keep the outputs')
+    args = parser.parse_args()
+
+    with open(os.path.join(fixtures_dir, 'fixtures.json')) as f:
+        fixtures = json.load(f)
+    if args.fixtures:
+        fixtures = [x for x in fixtures if x['name'] in args.fixtures]
+
+    workdir = args.keep or tempfile.mkdtemp(prefix='srcml-regression-')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    failed = 0
+    try:
+        for fixture in fixtures:
+            problems = check_fixture(fixture, workdir, args.update)
+            print('%-24s %s'%(fixture['name'],
+                              'FAILED' if problems else
+                              'updated' if args.update else 'ok'))
+            for p in problems:
+                print('   ', p)
+            failed += bool(problems)
+        if not args.no_timing and not args.update:
+            print('timing')
+            problems = check_timing(workdir, args.timing_factor)
+            failed += bool(problems)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir)
+
+    if failed:
+        print(failed, 'check(s) failed')
+    sys.exit(1 if failed else 0)
@@ -44,13 +44,8 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3 :: Only',
     ],
 
     # What does your project relate to?
@@ -60,12 +55,15 @@ setup(
     # simple. Or you can use find_packages().
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
 
-    py_modules=['srcml-to-mse'],
+    py_modules=['srcml_to_mse'],
 
-    install_requires=['future', 'lxml'],
+    python_requires='>=3',
+
+    install_requires=['lxml'],
 
     extras_require={
         'dev': ['check-manifest'],
+        'zstd': ['zstandard'],
         'test': [],
     },
 
@@ -74,7 +72,7 @@ setup(
 
     entry_points={
         'console_scripts': [
-            #'srcml-to-mse=srcml_to_mse:main',
+            'srcml-to-mse=srcml_to_mse:main',
         ],
     },
 )
@@ -0,0 +1,3440 @@
+#     Copyright 2016 Stephen Sinclair
+
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may not
+#     use this file except in compliance with the License. You may obtain a copy
+#     of the License at
+
+#         http://www.apache.org/licenses/LICENSE-2.0
+
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+
+"""Convert SrcML output for C++ code to MSE, for visualisation in Moose.
+
+As a library:
+
+    from srcml_to_mse import convert
+    convert('project.xml.bz2', 'project.mse', package='Project')
+
+or with a Converter, which can be reused for several inputs.  The
+srcml-to-mse command is the same as running main().
+"""
+
+from lxml import etree
+import sys, os, io, re, posixpath, argparse, multiprocessing, collections
+import bz2, gzip, lzma, array, struct
+import hashlib, pickle, marshal, sqlite3, json, time, contextlib, tempfile
+import fnmatch
+import cProfile, pstats, tracemalloc, signal
+try:
+    import resource
+except ImportError:
+    resource = None
+from concurrent.futures import ThreadPoolExecutor
+
+ns = {'src': u'http://www.srcML.org/srcML/src',
+      'cpp': u'http://www.srcML.org/srcML/cpp',
+      'pos': u'http://www.srcML.org/srcML/position'}
+
+SRC = '{%s}'%ns['src']
+CPP = '{%s}'%ns['cpp']
+POS = '{%s}'%ns['pos']
+
+# Text content of an element, as a plain string rather than an lxml
+# "smart" string that would keep the element alive
+text = etree.XPath('string()', smart_strings=False)
+
+# Formatting of MSE values.  These return the text of the value
+# directly, so that writing a node does not allocate an object for
+# each of its attributes.
+
+def mseRef(ref):
+    return '(ref: %d)'%ref.id
+
+def mseString(s):
+    # Quotes are doubled, as in Smalltalk
+    if s is not None and "'" in s:
+        s = s.replace("'", "''")
+    return "'%s'"%(s,)
+
+def mseBoolean(b):
+    return 'true' if b else 'false'
+
+def mseInteger(i):
+    return '%d'%i
+
+def mseValue(v):
+    if isinstance(v, Node):
+        return mseRef(v)
+    if isinstance(v, bool):
+        return mseBoolean(v)
+    if isinstance(v, int):
+        return mseInteger(v)
+    return mseString(v)
+
+def intern_str(s):
+    # Names, types and signatures repeat a lot, share one copy of each
+    return sys.intern(s) if s is not None else None
+
+# Qualified names.  Classes are known by their name qualified with the
+# enclosing namespaces and classes, and template arguments for
+# specialisations, with no spaces: "ns::Outer::Foo<int>".  Where a name
+# is used, the context is the tuple of prefixes of the enclosing scopes
+# to look for it in, innermost first: ("ns::Outer::", "ns::", "").
+
+global_context = ('',)
+
+def qualified_name(name):
+    return ''.join(name.split())
+
+def split_name(name):
+    """The qualifier and last component of a qualified name, ignoring
+    the :: in template arguments."""
+    depth = 0
+    for i in range(len(name) - 1, 0, -1):
+        c = name[i]
+        if c == '>':
+            depth += 1
+        elif c == '<':
+            depth -= 1
+        elif c == ':' and depth == 0 and name[i-1] == ':':
+            return name[:i-1], name[i+1:]
+    return '', name
+
+template_args = re.compile(r'<[^<>]*>')
+
+def strip_template_args(name):
+    while '<' in name:
+        stripped = template_args.sub('', name)
+        if stripped == name:
+            break
+        name = stripped
+    return name
+
+# Declared types.  The class a type refers to is found from its name
+# without qualifiers, pointers, references and array sizes, and with
+# wrappers replaced by the type they hold: templates such as smart
+# pointers, and namespaces of wrapper typedefs such as Siconos'
+# SP::Foo for a shared_ptr<Foo>.
+
+type_keywords = frozenset([
+    'const', 'volatile', 'static', 'virtual', 'inline', 'explicit',
+    'mutable', 'extern', 'constexpr', 'consteval', 'constinit', 'typename',
+    'struct', 'class', 'union', 'enum', 'register', 'friend',
+    'thread_local'])
+
+type_qualifiers = re.compile(r'\b(?:%s)\b|[*&]|\[[^\]]*\]'
+                             %'|'.join(sorted(type_keywords)))
+
+identifier = re.compile(r'\w+')
+
+default_type_wrappers = ('shared_ptr', 'unique_ptr', 'weak_ptr', 'auto_ptr',
+                         'scoped_ptr', 'intrusive_ptr', 'SP::', 'SPC::')
+
+def first_template_arg(name):
+    start = name.index('<') + 1
+    depth = 0
+    for i in range(start, len(name)):
+        c = name[i]
+        if c == '<':
+            depth += 1
+        elif c == '>':
+            if depth == 0:
+                return name[start:i]
+            depth -= 1
+        elif c == ',' and depth == 0:
+            return name[start:i]
+    return name[start:]
+
+def normalize_type(spelling, wrappers=frozenset(), prefixes=()):
+    """The qualified name of the class a type refers to, such as "Foo"
+    for "const std::shared_ptr<Foo> &".  `wrappers` are the names of
+    templates and `prefixes` the namespaces ending with :: that wrap
+    the type they hold."""
+    name = qualified_name(type_qualifiers.sub(' ', spelling))
+    while True:
+        prefix = next((p for p in prefixes if name.startswith(p)), None)
+        if prefix is not None:
+            name = name[len(prefix):]
+        elif (name.endswith('>') and '<' in name
+              and split_name(name[:name.index('<')])[1] in wrappers):
+            name = first_template_arg(name)
+        else:
+            return name
+
+# The model can have millions of nodes, so they all use __slots__ to
+# avoid the cost of a __dict__ per node.  Nodes are given the
+# Converter whose model they belong to, which numbers them and keeps
+# the nodes they create.
+
+class Node(object):
+    __slots__ = ('id', 'mse_node_type', 'sourceAnchor')
+    def __init__(self, model, mse_node_type):
+        self.id = model.new_id()
+        self.mse_node_type = mse_node_type
+        self.sourceAnchor = None
+    def add_sourceAnchor(self, model, unit, startline=None, endline=None):
+        fa = FileAnchor(model, self, unit, startline, endline)
+        self.sourceAnchor = fa
+        model.nodes.append(fa)
+    def add_sourceUnit(self, model, path, lines=None):
+        try:
+            u = model.units_by_path[path]
+            startline, endline = lines or (None, None)
+            self.add_sourceAnchor(model, u, startline, endline)
+        except KeyError:
+            model.log('Could not resolve sourceAnchor', path, 'for', self.id)
+    def add_declaredType(self, model, typename, context=global_context):
+        # Kept as a name until the type resolution pass finds its class
+        # in the context where it was used
+        self.declaredType = intern_str(typename)
+        if typename is not None:
+            model.unresolved.append((self, context))
+    def all_attribs(self):
+        """The FAMIX attributes of the node as (name, value) pairs, where
+        values are strings, numbers, booleans or other nodes."""
+        attribs = self.attribs()
+        if self.sourceAnchor is not None:
+            attribs.append(('sourceAnchor', self.sourceAnchor))
+        return attribs
+    def to_mse(self):
+        return '\t(%s (id: %d)%s)'%(self.mse_node_type, self.id,
+                                    ''.join(['\n\t\t(%s %s)'%(n, mseValue(v))
+                                             for n, v in self.all_attribs()]))
+
+class Package(Node):
+    __slots__ = ('name',)
+    def __init__(self, model, name):
+        Node.__init__(self, model, 'FAMIX.Package')
+        self.name = name
+    def attribs(self):
+        return [('name', self.name)]
+
+class CompilationUnit(Node):
+    __slots__ = ('filepath', 'filename', 'language', 'includes')
+    def __init__(self, model, filepath, lang):
+        Node.__init__(self, model, 'FAMIX.CompilationUnit')
+        self.filepath = intern_str(filepath)
+        self.filename = intern_str(os.path.split(filepath)[1])
+        self.language = intern_str(lang)
+        self.includes = []
+    def add_include(self, model, header):
+        i = Include(model, self, header)
+        self.includes.append(i)
+        model.nodes.append(i)
+    def attribs(self):
+        return [('filepath', self.filepath),
+                ('name', self.filename),
+                ('language', self.language)]
+
+class Header(Node):
+    __slots__ = ('filepath', 'filename', 'language', 'includes')
+    def __init__(self, model, filepath, lang):
+        Node.__init__(self, model, 'FAMIX.Header')
+        self.filepath = intern_str(filepath)
+        self.filename = intern_str(os.path.split(filepath)[1])
+        self.language = intern_str(lang)
+        self.includes = []
+    def add_include(self, model, header):
+        i = Include(model, self, header)
+        self.includes.append(i)
+        model.nodes.append(i)
+    def attribs(self):
+        return [('filepath', self.filepath),
+                ('name', self.filename),
+                ('language', self.language)]
+
+class Include(Node):
+    __slots__ = ('includingfile', 'includedfile')
+    def __init__(self, model, includingfile, includedfile):
+        Node.__init__(self, model, 'FAMIX.Include')
+        self.includingfile = includingfile
+        self.includedfile = includedfile
+    def attribs(self):
+        return [('source', self.includingfile),
+                ('target', self.includedfile)]
+
+class FileAnchor(Node):
+    __slots__ = ('element', 'unit', 'startline', 'endline')
+    def __init__(self, model, element, unit, startline=None, endline=None):
+        Node.__init__(self, model, 'FAMIX.FileAnchor')
+        self.element = element
+        self.unit = unit
+        self.startline = startline
+        self.endline = endline
+    def attribs(self):
+        result = [('element', self.element),
+                  ('unit', self.unit),
+                  ('fileName', self.unit.filename)]
+        if self.startline is not None:
+            result.append(('startLine', self.startline))
+        if self.endline is not None:
+            result.append(('endLine', self.endline))
+        return result
+
+class Class(Node):
+    __slots__ = ('package', 'name', 'key', 'context', 'methods',
+                 'methods_by_name', 'methods_by_signature', 'variables',
+                 'supers', 'inheritances')
+    def __init__(self, model, package, name, key=None, context=None):
+        Node.__init__(self, model, 'FAMIX.Class')
+        self.package = package
+        self.name = intern_str(name)
+        self.key = intern_str(key or name)   # qualified name
+        self.context = context or (self.key + '::',) + global_context
+        self.methods = []
+        self.methods_by_name = {}       # name -> overloads
+        self.methods_by_signature = {}  # (name, parameter types) -> method
+        self.variables = []
+        self.supers = []
+        self.inheritances = {}
+    def add_method(self, model, name, sig, returnType=None, arity=None,
+                   params=None):
+        met = Method(model, name, self, sig, returnType, arity)
+        self.methods.append(met)
+        self.methods_by_name.setdefault(met.name, []).append(met)
+        self.methods_by_signature.setdefault((met.name, params), met)
+        model.nodes.append(met)
+        return met
+    def find_method(self, name, params=None):
+        # The overload with these parameter types if there is one,
+        # otherwise one taking as many arguments, otherwise the first
+        # method with this name
+        met = self.methods_by_signature.get((name, params))
+        if met is not None:
+            return met
+        overloads = self.methods_by_name.get(name)
+        if not overloads:
+            return None
+        if params is not None:
+            met = best_overload(overloads, len(params))
+        return met or overloads[0]
+    def add_variable(self, model, name, typename):
+        attr = Attribute(model, name, typename, self)
+        self.variables.append(attr)
+        model.nodes.append(attr)
+    def add_superclass(self, name):
+        self.supers.append(intern_str(name))
+    def add_inheritance(self, model, superclass):
+        inh = Inheritance(model, self, superclass)
+        self.inheritances[superclass.key] = inh
+        model.nodes.append(inh)
+    def add_call(self, name, args):
+        pass
+    def attribs(self):
+        return [('name', self.name),
+                ('belongsToPackage', self.package)]
+
+class Inheritance(Node):
+    __slots__ = ('subclass', 'superclass')
+    def __init__(self, model, subclass, superclass):
+        Node.__init__(self, model, 'FAMIX.Inheritance')
+        self.subclass = subclass
+        self.superclass = superclass
+    def attribs(self):
+        return [('subclass', self.subclass),
+                ('superclass', self.superclass)]
+
+class Method(Node):
+    __slots__ = ('name', 'classclass', 'signature', 'declaredType', 'arity')
+    def __init__(self, model, name, classclass, signature, returnType=None,
+                 arity=None):
+        Node.__init__(self, model, 'FAMIX.Method')
+        self.add_declaredType(model, returnType, classclass.context)
+        self.name = intern_str(name)
+        self.classclass = classclass
+        self.signature = intern_str(signature)
+        self.arity = arity    # (least, most) arguments accepted
+    def attribs(self):
+        result = [('name', self.name),
+                  ('signature', self.signature),
+                  ('parentType', self.classclass)]
+        if isinstance(self.declaredType, Class):
+            result.append(('declaredType', self.declaredType))
+        return result
+
+class Attribute(Node):
+    __slots__ = ('name', 'classclass', 'declaredType')
+    def __init__(self, model, name, declaredType, classclass):
+        Node.__init__(self, model, 'FAMIX.Attribute')
+        self.name = intern_str(name)
+        self.add_declaredType(model, declaredType, classclass.context)
+        self.classclass = classclass
+    def attribs(self):
+        result = [('name', self.name),
+                  ('parentType', self.classclass)]
+        if isinstance(self.declaredType, Class):
+            result.append(('declaredType', self.declaredType))
+        return result
+
+class Function(Node):
+    __slots__ = ('name', 'signature', 'declaredType', 'arity', 'context')
+    def __init__(self, model, name, signature, returnType=None, arity=None,
+                 context=None):
+        Node.__init__(self, model, 'FAMIX.Function')
+        self.name = intern_str(name)
+        self.signature = intern_str(signature)
+        self.context = context or global_context
+        self.add_declaredType(model, returnType, self.context)
+        self.arity = arity
+    def attribs(self):
+        result = [('name', self.name),
+                  ('signature', self.signature)]
+        if isinstance(self.declaredType, Class):
+            result.append(('declaredType', self.declaredType))
+        return result
+
+class Invocation(Node):
+    __slots__ = ('signature', 'sender', 'receiver', 'count')
+    def __init__(self, model, signature, sender, receiver=None, count=None):
+        Node.__init__(self, model, 'FAMIX.Invocation')
+        self.signature = intern_str(signature)
+        self.sender = sender
+        self.receiver = receiver
+        self.count = count    # number of calls, when aggregated
+    def attribs(self):
+        result = [('signature', self.signature),
+                  ('sender', self.sender)]
+        if self.receiver is not None:
+            result.append(('receiver', self.receiver))
+        if self.count is not None:
+            result.append(('callCount', self.count))
+        return result
+
+# Parts of a parameter list left out of signatures
+signature_skip = frozenset([SRC+'comment', SRC+'init'])
+has_signature_skip = etree.XPath('boolean(.//src:comment|.//src:init)',
+                                 namespaces=ns)
+# Space left before ) or , where a default value or comment was
+signature_space = re.compile(r'\s+(?=[),])')
+
+def signature_text(el, parts):
+    if el.text:
+        parts.append(el.text)
+    for child in el:
+        if child.tag not in signature_skip:
+            signature_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+    return parts
+
+def make_signature(name, args, ty=None):
+    if has_signature_skip(args):
+        args_text = ''.join(signature_text(args, []))
+    else:
+        args_text = text(args)
+    signature = '%s%s'%(text(name), args_text)
+    if ty is not None:
+        signature = '%s %s'%(text(ty),
+                             signature)
+    return signature_space.sub('', ' '.join(signature.split()))
+
+parameter_tags = frozenset([SRC+'parameter', SRC+'param'])
+
+# Spaces that do not change the meaning of a parameter type
+param_type_space = re.compile(r'\s*([*&<>,]|::)\s*')
+
+def parameter_types(args):
+    """The types of a parameter list without the names and default
+    values of the parameters, to tell a method's declaration and
+    definition from the other overloads."""
+    types = []
+    for p in args:
+        if p.tag in parameter_tags:
+            ty = p.find('{*}decl/{*}type')
+            spelling = ' '.join(text(ty if ty is not None else p).split())
+            types.append(param_type_space.sub(r'\1', spelling))
+    if types in ([''], ['void']):
+        types = []
+    return tuple(types)
+
+# Arities are shared, there are only a few different ones
+arities = {}
+
+def parameter_arity(args):
+    """The least and most number of arguments accepted by a parameter
+    list, the most being None for variadic functions."""
+    params = [text(p) for p in args if p.tag in parameter_tags]
+    if len(params) == 1 and params[0].strip() in ('', 'void'):
+        params = []
+    low = high = len(params)
+    for p in params:
+        if '...' in p:
+            low -= 1
+            high = None
+        elif '=' in p:
+            low -= 1
+    arity = (low, high)
+    return arities.setdefault(arity, arity)
+
+# Source lines.  With "srcml --position" each element has a pos:start
+# (or pos:line with older versions of SrcML) and pos:end giving its
+# line and column.  Otherwise the lines of the elements that need them
+# are found by counting the newlines of the whole unit once: SrcML
+# keeps the source text as it is, so the newlines before a tag in the
+# serialized unit give its line.
+
+line_tags = [SRC+'class', SRC+'function', SRC+'function_decl', SRC+'call']
+line_tag = re.compile(br'<(/?)(?:class|function|function_decl|call)(?=[\s/>])')
+
+def position_lines(el):
+    """The (start, end) lines of an element from its pos: attributes,
+    or None if it has none."""
+    start = el.get(POS+'start')
+    if start is None:
+        start = el.get(POS+'line')
+        if start is None:
+            return None
+        return (int(start), None)
+    end = el.get(POS+'end')
+    return (int(start.split(':')[0]),
+            int(end.split(':')[0]) if end is not None else None)
+
+def unit_lines(unit, xml=None):
+    """The (start, end) lines of each element of a unit in `line_tags`,
+    from its serialized XML.  The tags are found with a regular
+    expression and the newlines between them counted, which is much
+    faster than visiting every piece of text from Python."""
+    if xml is None:
+        xml = etree.tostring(unit, with_tail=False)
+    lines = []
+    starts = []
+    line = 1
+    pos = 0
+    for m in line_tag.finditer(xml):
+        line += xml.count(b'\n', pos, m.start())
+        pos = m.start()
+        if not m.group(1):
+            starts.append(len(lines))
+            lines.append(line)
+        elif starts:
+            i = starts.pop()
+            lines[i] = (lines[i], line)
+        else:
+            starts = None
+            break
+    elements = list(unit.iter(*line_tags))
+    if starts or starts is None or len(elements) != len(lines):
+        # Not written the way SrcML writes it, count while walking
+        return walk_unit_lines(unit)
+    return dict(zip(elements, lines))
+
+def walk_unit_lines(unit):
+    lines = {}
+    starts = []
+    line = 1
+    tags = frozenset(line_tags)
+    for event, el in etree.iterwalk(unit, events=('start', 'end')):
+        if event == 'start':
+            if el.tag in tags:
+                starts.append(line)
+            t = el.text
+        else:
+            if el.tag in tags:
+                lines[el] = (starts.pop(), line)
+            t = el.tail
+        if t:
+            line += t.count('\n')
+    return lines
+
+# Facts gathered from a single <unit>.  The XML of a unit is freed as
+# soon as its facts are extracted, so everything that refers to other
+# units (includes, inheritance, senders) is kept by name and resolved
+# once all units have been read.
+
+class ClassFacts(object):
+    def __init__(self, name, key, context):
+        self.name = name
+        self.key = key          # qualified name, see qualified_name()
+        self.context = context  # where names used in it are looked for
+        self.supers = []
+        self.methods = []    # (name, signature, return type, arity,
+                             # lines, parameter types)
+        self.variables = []  # (name, type name)
+        self.lines = None    # (start, end)
+
+class UnitFacts(object):
+    def __init__(self, path, lang):
+        self.path = path
+        self.language = lang
+        self.includes = []   # (included file name, angle brackets)
+        self.classes = []    # ClassFacts
+        self.functions = []  # (name, signature, return type, arity, lines,
+                             #  context)
+        self.calls = []      # (signature, sender, callee name, arguments,
+                             #  lines)
+        self.aliases = []    # (key, name, target type, context)
+
+# A sender is either ('method', class key, method name, method
+# signature) for calls inside a class definition, or ('function',
+# context, signature, class name, method name, method signature) for
+# calls inside a function implementation, where the class and method
+# are given for out-of-line method definitions.
+
+def template_parameters(el):
+    """Names of the template parameters of a class or function."""
+    template = el.find('{*}template')
+    if template is None:
+        parent = el.getparent()
+        if parent is None or parent.tag != SRC+'template':
+            return ()
+        template = parent
+    return [text(n) for p in template.iterfind('{*}parameter_list/*')
+            for n in template_parameter_name(p)]
+
+# Base classes, <super_list> being new in SrcML 1.0
+class_supers = etree.XPath('./src:super/src:name'
+                           '|./src:super_list/src:super/src:name',
+                           namespaces=ns)
+
+template_parameter_name = etree.XPath('./src:name|./src:decl/src:name',
+                                      namespaces=ns)
+
+def unit_language(unit):
+    path = unit.attrib['filename']
+    lang = unit.attrib['language']
+    if os.path.splitext(path)[1]=='.i':
+        lang = 'SWIG'
+    return lang
+
+# The kinds of entities that can be extracted.  Invocations need the
+# classes and functions they are made from.
+entity_kinds = frozenset(['includes', 'classes', 'functions', 'invocations'])
+
+def entity_closure(kinds):
+    kinds = frozenset(kinds)
+    if 'invocations' in kinds:
+        kinds |= frozenset(['classes', 'functions'])
+    return kinds
+
+class Scope(object):
+    """Where the walk over a unit is: the unit and its language, the
+    innermost class and function, whether it is inside a constructor,
+    and the facts of all the enclosing classes.  A new scope is pushed
+    when entering a class, function or constructor, so handlers never
+    need to look at the ancestors of an element."""
+
+    __slots__ = ('path', 'language', 'in_class', 'class_name', 'classes',
+                 'function', 'constructor', 'sender', 'prefix', 'context',
+                 'template_parameters')
+
+    # Marks a sender that has not been looked for yet
+    unknown = object()
+
+    def __init__(self, path, language):
+        self.path = path
+        self.language = language
+        self.in_class = False
+        self.class_name = None
+        self.classes = ()
+        self.function = None
+        self.constructor = False
+        self.sender = Scope.unknown
+        self.prefix = ''
+        self.context = global_context
+        self.template_parameters = frozenset()
+
+    def child(self):
+        s = Scope(self.path, self.language)
+        s.in_class = self.in_class
+        s.class_name = self.class_name
+        s.classes = self.classes
+        s.function = self.function
+        s.constructor = self.constructor
+        s.prefix = self.prefix
+        s.context = self.context
+        s.template_parameters = self.template_parameters
+        return s
+
+    def enter(self, name):
+        """Make this scope the namespace or class `name` inside the
+        enclosing one."""
+        self.prefix = '%s%s::'%(self.prefix, name)
+        self.context = (self.prefix,) + self.context
+
+    def add_template_parameters(self, el):
+        names = template_parameters(el)
+        if names:
+            self.template_parameters = self.template_parameters.union(names)
+
+    def type_name(self, name):
+        """A type as written in this scope, or None for a template
+        parameter, which is not a class."""
+        if not name:
+            return None
+        if self.template_parameters:
+            for word in identifier.findall(name):
+                if word not in type_keywords:
+                    if word in self.template_parameters:
+                        return None
+                    break
+        return name
+
+class UnitVisitor(object):
+    """Extract the facts of one <unit> in a single walk over its
+    elements.  Handlers are dispatched on the element tag, and the
+    enclosing classes, functions and constructors are tracked on a
+    stack of scopes so that no handler needs to search the ancestors of
+    an element."""
+
+    def __init__(self, unit, xml=None, kinds=entity_kinds):
+        self.unit = unit
+        self.xml = xml
+        self.facts = UnitFacts(unit.attrib['filename'], unit_language(unit))
+        self.scopes = [Scope(self.facts.path, unit.attrib['language'])]
+        self.swig_includes = []
+        self.cpp_includes = []
+        self.signatures = {}
+        self.counted_lines = None
+
+        self.start = {SRC+'namespace': self.start_namespace,
+                      SRC+'class': self.start_class,
+                      SRC+'class_decl': self.start_class_decl,
+                      SRC+'function': self.start_function,
+                      SRC+'function_decl': self.start_function_decl,
+                      SRC+'constructor': self.start_constructor,
+                      SRC+'constructor_decl': self.start_constructor,
+                      SRC+'decl': self.start_decl,
+                      SRC+'typedef': self.start_typedef,
+                      SRC+'using': self.start_using}
+        self.end = {SRC+'namespace': self.end_scope,
+                    SRC+'class': self.end_scope,
+                    SRC+'class_decl': self.end_scope,
+                    SRC+'function': self.end_scope,
+                    SRC+'function_decl': self.end_scope,
+                    SRC+'constructor': self.end_scope,
+                    SRC+'constructor_decl': self.end_scope}
+        if 'invocations' in kinds and not self.facts.path[-2:]=='.i':
+            self.start[SRC+'call'] = self.start_call
+        if 'includes' in kinds:
+            if self.facts.language == 'SWIG':
+                self.start[SRC+'literal'] = self.start_literal
+            if self.facts.language in ('C','C++','SWIG'):
+                self.start[CPP+'file'] = self.start_file
+
+    def visit(self):
+        start, end = self.start, self.end
+        for event, el in etree.iterwalk(self.unit, events=('start', 'end'),
+                                        tag=list(start)):
+            if event == 'start':
+                start[el.tag](el)
+            elif el.tag in end:
+                end[el.tag](el)
+        self.facts.includes = self.swig_includes + self.cpp_includes
+        return self.facts
+
+    def signature(self, name, args, ty=None):
+        # Function signatures are needed both for the function and as
+        # the sender of its calls, so compute them once
+        key = (name, args, ty)
+        sig = self.signatures.get(key)
+        if sig is None:
+            sig = make_signature(name, args, ty)
+            self.signatures[key] = sig
+        return sig
+
+    def lines(self, el):
+        lines = position_lines(el)
+        if lines is None:
+            if self.counted_lines is None:
+                self.counted_lines = unit_lines(self.unit, self.xml)
+            lines = self.counted_lines.get(el)
+        return lines
+
+    def push_scope(self):
+        scope = self.scopes[-1].child()
+        self.scopes.append(scope)
+        return scope
+
+    def end_scope(self, el):
+        self.scopes.pop()
+
+    def start_namespace(self, n):
+        name = n.find('{*}name')
+        scope = self.push_scope()
+        if n.getparent().tag == SRC+'using':
+            # using namespace: its names can be used without qualifying
+            # them in the rest of the enclosing scope
+            if name is not None:
+                used = qualified_name(text(name))
+                outer = self.scopes[-2]
+                outer.context = outer.context + tuple(
+                    '%s%s::'%(p, used) for p in outer.context)
+        elif name is not None:
+            scope.enter(qualified_name(text(name)))
+        else:
+            # Anonymous namespaces are private to each file
+            scope.enter('(anonymous %s)'%scope.path)
+
+    def start_class(self, cl):
+        name = cl.find('{*}name')
+        scope = self.push_scope()
+        scope.in_class = True
+        scope.class_name = None
+        scope.add_template_parameters(cl)
+        if name is None:
+            return
+        qualified = qualified_name(text(name))
+        scope.enter(qualified)
+        scope.class_name = scope.prefix[:-2]
+        if scope.language in ('C', 'C++'):
+            cf = ClassFacts(split_name(qualified)[1], scope.class_name,
+                            scope.context)
+            cf.lines = self.lines(cl)
+            for s in class_supers(cl):
+                cf.supers.append(text(s))
+            self.facts.classes.append(cf)
+            scope.classes = scope.classes + (cf,)
+
+    def start_class_decl(self, cl):
+        scope = self.push_scope()
+        scope.in_class = True
+        scope.class_name = None
+
+    def start_constructor(self, const):
+        self.push_scope().constructor = True
+
+    def start_function_decl(self, m):
+        scope = self.push_scope()
+        scope.function = m
+        if not scope.classes:
+            return
+        scope.add_template_parameters(m)
+        name = m.find('./{*}name')
+        ty = m.find('./{*}type')
+        args = m.find('./{*}parameter_list')
+        if name is None or args is None:
+            return
+        method = (text(name),
+                  self.signature(name, args, ty),
+                  scope.type_name(text(ty) if ty is not None else None),
+                  parameter_arity(args),
+                  self.lines(m),
+                  parameter_types(args))
+        for cf in scope.classes:
+            cf.methods.append(method)
+
+    def start_decl(self, decl):
+        scope = self.scopes[-1]
+        classes = scope.classes
+        if not classes:
+            return
+        for d in decl.iterfind('./{*}name'):
+            typename = None
+            if d.getprevious() is not None and 'type' in d.getprevious().tag:
+                typename = text(d.getprevious())
+            typename = scope.type_name(typename)
+            for cf in classes:
+                cf.variables.append((text(d), typename))
+
+    def start_typedef(self, t):
+        name = t.find('{*}name')
+        ty = t.find('{*}type')
+        # typedef struct {...} name is a class of its own
+        if ty is not None and ty.find('.//{*}block') is None:
+            self.add_alias(name, ty)
+
+    def start_using(self, u):
+        name = u.find('{*}name')
+        ty = u.find('{*}type')
+        if ty is None:
+            ty = u.find('{*}init/{*}type')
+        self.add_alias(name, ty)
+
+    def add_alias(self, name, ty):
+        scope = self.scopes[-1]
+        if name is None or ty is None or scope.language not in ('C', 'C++'):
+            return
+        target = scope.type_name(text(ty))
+        if target is not None:
+            alias = qualified_name(text(name))
+            self.facts.aliases.append(('%s%s'%(scope.prefix, alias), alias,
+                                       target, scope.context))
+
+    def start_function(self, func):
+        scope = self.push_scope()
+        scope.function = func
+        scope.add_template_parameters(func)
+        if scope.in_class:
+            return
+        name = func.find('./{*}name')
+        if name is None:
+            return
+        if text(name)[:1]=='$':  # skip some templates in LAPACK
+            return
+        # Out-of-line method definitions, A::f or ns::A::f
+        if (len(name)>=3 and 'operator' in name[-2].tag
+            and text(name[-2])=='::'):
+            return
+        args = func.find('./{*}parameter_list')
+        if args is None:
+            return
+        ty = func.find('./{*}type')
+        if ty is not None:
+            tyname = scope.type_name(text(ty))
+        else:
+            tyname = None
+        signature = self.signature(name, args, ty)
+        self.facts.functions.append((text(name), signature,
+                                     tyname, parameter_arity(args),
+                                     self.lines(func), scope.context))
+
+    def sender(self, scope):
+        if scope.sender is Scope.unknown:
+            scope.sender = self.find_sender(scope)
+        return scope.sender
+
+    def find_sender(self, scope):
+        func = scope.function
+        if scope.in_class:
+            # In a class definition
+            # Find the class and sender is the method
+            if scope.class_name is None or scope.constructor:
+                return None #TODO constructors
+            if func is None:
+                return None
+            name = func.find('{*}name')
+            if name is None:
+                return None
+            args = func.find('{*}parameter_list')
+            methsig = params = None
+            if args is not None:
+                methsig = self.signature(name, args, func.find('{*}type'))
+                params = parameter_types(args)
+            return ('method', scope.class_name, text(name), methsig, params)
+
+        if func is None or scope.language not in ('C','C++'):
+            return None
+
+        # In a function implementation: If implementation of a
+        # method, find the class and sender is the method.
+        # Otherwise, sender is the function, if found.
+        caller_name = func.find('./{*}name')
+        caller_args = func.find('./{*}parameter_list')
+        caller_type = func.find('./{*}type')
+        if caller_name is None or caller_args is None:
+            return None
+
+        # skip some templates in LAPACK
+        if text(caller_name)[:1]=='$':
+            return None
+
+        caller_sig = self.signature(caller_name, caller_args, caller_type)
+        class_name = method_name = method_sig = params = None
+        if (len(caller_name)>=3 and
+            text(caller_name[-2])=='::'):
+            class_name = qualified_name(''.join(text(n)
+                                                for n in caller_name[:-2]))
+            method_name = text(caller_name[-1])
+            method_sig = self.signature(caller_name[-1], caller_args,
+                                        caller_type)
+            params = parameter_types(caller_args)
+        return ('function', scope.context, caller_sig, class_name,
+                method_name, method_sig, params)
+
+    def start_call(self, c):
+        sender = self.sender(self.scopes[-1])
+        if sender:
+            name = c.find('{*}name')
+            callee = text(name).strip() if name is not None else None
+            args = c.find('{*}argument_list')
+            nargs = (len(args.findall('{*}argument'))
+                     if args is not None else None)
+            self.facts.calls.append((text(c),
+                                     sender, callee, nargs,
+                                     self.lines(c)))
+
+    def start_literal(self, i):
+        p = i.getprevious()
+        if p is not None:
+            p2 = p.getprevious()
+            if (p2 is not None
+                and text(p)=='include'
+                and text(p2)=='%'):
+
+                fn = text(i).split('"')
+                if len(fn)==3:
+                    fn = fn[1]
+                elif len(fn)==1:
+                    fn = fn[0]
+                else:
+                    fn = None
+                self.swig_includes.append((fn, False))
+
+    def start_file(self, i):
+        if i.getparent().tag == CPP+'include':
+            fn = text(i).strip()
+            angled = fn.startswith('<')
+            fn = fn.replace('>','').replace('<','').replace('"','')
+            self.cpp_includes.append((fn, angled))
+
+def unit_facts(unit, xml=None, kinds=entity_kinds):
+    return UnitVisitor(unit, xml, kinds).visit()
+
+class UnitFilter(object):
+    """Which units of a SrcML document to convert.  A unit is kept if
+    its path matches one of the shell patterns in `paths`, if any, and
+    none of those in `exclude`, and its language, as given by
+    unit_language(), is one of `languages`, if any."""
+
+    def __init__(self, paths=(), exclude=(), languages=()):
+        self.paths = self.patterns(paths)
+        self.exclude = self.patterns(exclude)
+        self.languages = frozenset(l.lower() for l in languages)
+        self.skipped = 0
+
+    @staticmethod
+    def patterns(globs):
+        if not globs:
+            return None
+        return re.compile('|'.join(fnmatch.translate(g) for g in globs))
+
+    def __bool__(self):
+        return bool(self.paths or self.exclude or self.languages)
+
+    def match(self, path, language=None):
+        """Whether to keep a unit, its language not being checked if it
+        is not given."""
+        return ((self.paths is None or self.paths.match(path))
+                and (self.exclude is None or not self.exclude.match(path))
+                and (not self.languages or language is None
+                     or language.lower() in self.languages))
+
+    def __call__(self, unit):
+        keep = self.match(unit.attrib['filename'], unit_language(unit))
+        if not keep:
+            self.skipped += 1
+        return keep
+
+def iter_units(source, accept=None):
+    """Yield each file <unit> of a SrcML document while it is being
+    parsed, freeing it once the consumer is done with it.  Units for
+    which `accept` returns false are freed without being yielded."""
+    found = False
+    for event, unit in etree.iterparse(source, events=('end',),
+                                       tag='{%s}unit'%ns['src'],
+                                       huge_tree=True):
+        parent = unit.getparent()
+        if parent is not None:
+            found = True
+            if 'filename' in unit.attrib and (accept is None or accept(unit)):
+                yield unit
+            # Drop this unit and the ones before it
+            unit.clear()
+            while unit.getprevious() is not None:
+                del parent[0]
+        elif (not found and 'filename' in unit.attrib
+              and (accept is None or accept(unit))):
+            # Not an archive, the root is the only unit
+            yield unit
+
+# Compressed input.  The format is found from the first bytes of the
+# file rather than its name.  Files made of several independent
+# streams, such as those written by pbzip2, lbzip2, pzstd or
+# --compress-threads, are split at the stream boundaries and the
+# pieces decompressed in a thread pool while the parser reads.
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def need_zstandard():
+    if zstandard is None:
+        raise ValueError('zstd compression needs the zstandard module')
+    return zstandard
+
+class Compression(object):
+    """How to read and write one compressed format: `open` wraps a
+    binary file for streaming, `compress` compresses a whole chunk to an
+    independent stream, and `decompressor` makes an object decompressing
+    a single stream (with `eof` and `unused_data`).  Streams of formats
+    with a `boundary` pattern can be decompressed in parallel."""
+
+    def __init__(self, name, suffix, magic, open, compress,
+                 decompressor=None, boundary=None):
+        self.name = name
+        self.suffix = suffix
+        self.magic = magic
+        self.open = open
+        self.compress = compress
+        self.decompressor = decompressor
+        self.boundary = boundary
+
+compressions = collections.OrderedDict((c.name, c) for c in [
+    Compression('bz2', '.bz2', b'BZh',
+                lambda f, mode='rb', level=9: bz2.BZ2File(
+                    f, mode, compresslevel=level),
+                bz2.compress, bz2.BZ2Decompressor,
+                # Stream header followed by the first block header
+                re.compile(b'BZh[1-9]1AY&SY')),
+    Compression('gzip', '.gz', b'\x1f\x8b',
+                lambda f, mode='rb', level=9: gzip.GzipFile(
+                    fileobj=f, mode=mode, compresslevel=level),
+                gzip.compress),
+    Compression('xz', '.xz', b'\xfd7zXZ\x00',
+                lambda f, mode='rb', level=9: lzma.LZMAFile(
+                    f, mode, preset=level if 'w' in mode else None),
+                lambda data, level=9: lzma.compress(data, preset=level)),
+    Compression('zstd', '.zst', b'\x28\xb5\x2f\xfd',
+                lambda f, mode='rb', level=9: (
+                    need_zstandard().ZstdDecompressor().stream_reader(
+                        f, read_across_frames=True, closefd=False)
+                    if 'r' in mode else
+                    need_zstandard().ZstdCompressor(level).stream_writer(
+                        f, closefd=False)),
+                lambda data, level=9: need_zstandard().ZstdCompressor(
+                    level).compress(data),
+                lambda: need_zstandard().ZstdDecompressor().decompressobj(),
+                re.compile(re.escape(b'\x28\xb5\x2f\xfd'))),
+])
+
+# Names of compressed SrcML files, as they were recognised before the
+# format was read from the file itself
+compressed_suffixes = ('.bz2', '.gzip', '.gz', '.xz', '.zst')
+
+def detect_compression(f):
+    """The Compression of a binary file, or None, without consuming
+    any of it."""
+    head = f.peek(8)[:8]
+    for c in compressions.values():
+        if head.startswith(c.magic):
+            return c
+    return None
+
+def decompress_streams(decompressor, data):
+    """Decompress a run of whole streams.  Returns the output and
+    'ok', or 'partial' if the data stops inside a stream, as it does
+    when split at something only looking like the start of one, or
+    'error'."""
+    out = []
+    while data:
+        d = decompressor()
+        try:
+            out.append(d.decompress(data))
+        except Exception:
+            return b''.join(out), 'error'
+        if not d.eof:
+            return b''.join(out), 'partial'
+        data = d.unused_data
+    return b''.join(out), 'ok'
+
+class ParallelDecompressor(io.RawIOBase):
+    """Read a compressed file made of several streams, decompressing
+    runs of streams in a thread pool, a few pieces ahead of the reader.
+    Pieces are kept small since the XML compresses very well.  A file
+    of a single stream, or one that cannot be split, is decompressed as
+    it is read instead."""
+
+    def __init__(self, raw, compression, threads, piece_size=1<<18,
+                 max_piece=1<<20):
+        io.RawIOBase.__init__(self)
+        self.raw = raw
+        self.compression = compression
+        self.threads = threads
+        self.piece_size = piece_size
+        self.max_piece = max_piece
+        self.executor = ThreadPoolExecutor(threads)
+        self.pending = collections.deque()  # (piece, future)
+        self.carry = b''
+        self.split = False
+        self.unsplit = False
+        self.stream = None
+        self.buffer = b''
+        self.offset = 0
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def next_piece(self):
+        """Read up to the last stream boundary in the next part of the
+        file, or return None at the end of the file."""
+        while True:
+            data = self.raw.read(self.piece_size)
+            if not data:
+                if not self.split:
+                    self.unsplit = True
+                    return None
+                piece, self.carry = self.carry, b''
+                return piece or None
+            piece = self.carry + data
+            cut = None
+            for m in self.compression.boundary.finditer(
+                    piece, max(1, len(self.carry) - 16)):
+                cut = m.start()
+            if cut is not None:
+                self.split = True
+                self.carry = piece[cut:]
+                return piece[:cut]
+            self.carry = piece
+            if len(piece) > self.max_piece:
+                self.unsplit = True
+                return None
+
+    def stream_from(self, piece):
+        """Decompress the rest of the file as it is read, from `piece`."""
+        rest = [piece]
+        for p, future in self.pending:
+            future.cancel()
+            rest.append(p)
+        rest.append(self.carry)
+        self.pending.clear()
+        self.carry = b''
+        self.stream = self.compression.open(io.BufferedReader(
+            ChainReader(b''.join(rest), self.raw)))
+
+    def fill(self):
+        self.buffer = b''
+        self.offset = 0
+        if self.stream is not None:
+            self.buffer = self.stream.read(self.piece_size)
+            self.done = not self.buffer
+            return
+        while not self.unsplit and len(self.pending) <= 2*self.threads:
+            piece = self.next_piece()
+            if piece is None:
+                break
+            self.pending.append((piece, self.executor.submit(
+                decompress_streams, self.compression.decompressor, piece)))
+        if not self.pending:
+            if self.carry:
+                self.stream_from(b'')
+            else:
+                self.done = True
+            return
+        piece, future = self.pending.popleft()
+        data, status = future.result()
+        while status == 'partial' and self.pending:
+            # Split inside a stream, join with the next piece
+            next_piece, next_future = self.pending.popleft()
+            next_future.cancel()
+            piece += next_piece
+            data, status = decompress_streams(self.compression.decompressor,
+                                              piece)
+        if status != 'ok':
+            self.stream_from(piece)
+            return
+        self.buffer = data
+
+    def readinto(self, b):
+        while self.offset >= len(self.buffer) and not self.done:
+            self.fill()
+        n = min(len(b), len(self.buffer) - self.offset)
+        b[:n] = memoryview(self.buffer)[self.offset:self.offset+n]
+        self.offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            for piece, future in self.pending:
+                future.cancel()
+            self.executor.shutdown()
+        io.RawIOBase.close(self)
+
+class ChainReader(io.RawIOBase):
+    """Some bytes followed by the rest of a file."""
+
+    def __init__(self, head, f):
+        io.RawIOBase.__init__(self)
+        self.head = head
+        self.f = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.head:
+            n = min(len(b), len(self.head))
+            b[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        data = self.f.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+def open_input(input, threads=0):
+    """Open a SrcML file name or binary file for reading, decompressing
+    it if needed.  Returns the underlying file, whose position shows
+    how far the input has been read, and the file to parse."""
+    raw = open(input, 'rb') if not hasattr(input, 'read') else input
+    if not hasattr(raw, 'peek'):
+        raw = io.BufferedReader(raw)
+    compression = detect_compression(raw)
+    if compression is None:
+        return raw, raw
+    if compression.boundary is not None:
+        threads = threads or multiprocessing.cpu_count()
+        return raw, io.BufferedReader(
+            ParallelDecompressor(raw, compression, threads), 1<<16)
+    return raw, compression.open(raw)
+
+class FactCache(object):
+    """On-disk store of the facts of each unit, keyed by the unit file
+    name and checked against a hash of the unit's XML, so that a later
+    run only extracts the units that changed."""
+
+    # Bump when the extracted facts change
+    version = 14
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        (version,) = self.db.execute('PRAGMA user_version').fetchone()
+        if version != self.version:
+            self.db.execute('DROP TABLE IF EXISTS facts')
+            self.db.execute('PRAGMA user_version = %d'%self.version)
+        self.db.execute('CREATE TABLE IF NOT EXISTS facts '
+                        '(filename TEXT PRIMARY KEY, hash TEXT, facts BLOB)')
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, filename, key):
+        self.seen.add(filename)
+        row = self.db.execute('SELECT facts FROM facts '
+                              'WHERE filename=? AND hash=?',
+                              (filename, key)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, filename, key, facts):
+        self.db.execute('INSERT OR REPLACE INTO facts VALUES (?, ?, ?)',
+                        (filename, key,
+                         pickle.dumps(facts, pickle.HIGHEST_PROTOCOL)))
+
+    def close(self, prune=True):
+        # Forget units that are no longer in the input, unless only some
+        # of them were read
+        if prune:
+            stale = [(f,) for (f,)
+                     in self.db.execute('SELECT filename FROM facts')
+                     if f not in self.seen]
+            self.db.executemany('DELETE FROM facts WHERE filename=?', stale)
+        self.db.commit()
+        self.db.close()
+
+def unit_key(xml):
+    return hashlib.sha1(xml).hexdigest()
+
+def cached_unit_facts(units, cache):
+    """Yield the facts of each unit, reading only the units that are not
+    in the cache."""
+    for unit in units:
+        filename = unit.attrib['filename']
+        xml = etree.tostring(unit, with_tail=False)
+        key = unit_key(xml)
+        facts = cache.get(filename, key)
+        if facts is None:
+            facts = unit_facts(unit, xml)
+            cache.put(filename, key, facts)
+        yield facts
+
+def parse_units(data, kinds=entity_kinds):
+    """Extract the facts of a batch of serialized units, used by the
+    worker processes when converting with several jobs."""
+    parser = etree.XMLParser(huge_tree=True)
+    return [unit_facts(etree.fromstring(d, parser), d, kinds) for d in data]
+
+def collect_batch(batch, cache):
+    slots, result = batch
+    parsed = iter(result.get())
+    for filename, key, facts in slots:
+        if facts is None:
+            facts = next(parsed)
+            if cache is not None:
+                cache.put(filename, key, facts)
+        yield facts
+
+def parallel_unit_facts(units, jobs, cache=None, kinds=entity_kinds,
+                        batch_size=64, batch_bytes=1<<20):
+    """Extract unit facts in a pool of worker processes, in the order
+    the units are read.  Units missing from the cache are sent to the
+    workers in batches, and only a few batches are in flight at a time
+    so that the input is still streamed."""
+    pool = multiprocessing.Pool(jobs)
+    pending = collections.deque()
+    slots, data, size = [], [], 0
+    try:
+        for unit in units:
+            filename = unit.attrib['filename']
+            xml = etree.tostring(unit, with_tail=False)
+            key = facts = None
+            if cache is not None:
+                key = unit_key(xml)
+                facts = cache.get(filename, key)
+            if facts is None:
+                data.append(xml)
+                size += len(xml)
+            slots.append((filename, key, facts))
+            if len(data) >= batch_size or size >= batch_bytes:
+                batch = pool.apply_async(parse_units, (data, kinds))
+                pending.append((slots, batch))
+                slots, data, size = [], [], 0
+                while len(pending) > 2*jobs:
+                    for facts in collect_batch(pending.popleft(), cache):
+                        yield facts
+        if slots:
+            batch = pool.apply_async(parse_units, (data, kinds))
+            pending.append((slots, batch))
+        while pending:
+            for facts in collect_batch(pending.popleft(), cache):
+                yield facts
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+class ClassIndex(object):
+    """Classes by qualified name.  A name used somewhere is looked for
+    as C++ does, in each enclosing class and namespace from the
+    innermost out, then without its template arguments for a template
+    with no matching specialisation.  Failing that, a name written
+    without :: is found alone, if only one class has that name, but a
+    qualified name such as std::string is never taken for a class of
+    the same name in another namespace.
+
+    Classes with the same qualified name in different units are all
+    kept.  Where the name is used, the one in the same unit is
+    preferred, then one in a unit it includes, then the one sharing the
+    longest directory prefix with it.  Lookups are memoized, so they
+    cost a few dictionary lookups however many classes there are."""
+
+    def __init__(self, units_by_path=None):
+        self.units_by_path = units_by_path or {}
+        self.by_key = {}    # qualified name -> classes
+        self.by_name = {}   # unqualified name -> classes
+        self.names = {}     # name as written -> forms looked for
+        self.found = {}
+        self.chosen = {}
+
+    def __len__(self):
+        return sum(len(c) for c in self.by_key.values())
+
+    def __iter__(self):
+        for classes in self.by_key.values():
+            for cl in classes:
+                yield cl
+
+    def values(self):
+        return iter(self)
+
+    def add(self, cl):
+        self.by_key.setdefault(cl.key, []).append(cl)
+        self.by_name.setdefault(cl.name, []).append(cl)
+
+    def get(self, key, path=None):
+        """The class with exactly this qualified name."""
+        return self.choose(self.by_key.get(key), path)
+
+    def find(self, name, context=global_context, path=None):
+        """The class called `name` where the lookup `context` applies,
+        in the unit `path` if given."""
+        key = (name, context)
+        try:
+            candidates = self.found[key]
+        except KeyError:
+            candidates = self.found[key] = self.lookup(name, context)
+        return self.choose(candidates, path)
+
+    def forms(self, name):
+        """The qualified names to look for, and the unqualified name,
+        for a name as it is written."""
+        forms = self.names.get(name)
+        if forms is None:
+            qualified = qualified_name(name)
+            keys = [qualified]
+            if '<' in qualified:
+                keys.append(strip_template_args(qualified))
+            last = keys[-1]
+            if ':' in last:
+                last = split_name(last)[1]
+            forms = self.names[name] = (keys, last)
+        return forms
+
+    def lookup(self, name, context):
+        keys, last = self.forms(name)
+        qualified = '::' in keys[-1]
+        if keys[0].startswith('::'):
+            keys = [k[2:] for k in keys]
+            context = global_context
+        for k in keys:
+            for prefix in context:
+                found = self.by_key.get(prefix + k)
+                if found:
+                    return found
+        if qualified:
+            return None
+        found = self.by_name.get(last)
+        if found and len(found) == 1:
+            return found
+        return None
+
+    def choose(self, candidates, path):
+        if not candidates:
+            return None
+        if len(candidates) == 1 or path is None:
+            return candidates[0]
+        key = (candidates[0].key, path)
+        cl = self.chosen.get(key)
+        if cl is None:
+            cl = self.chosen[key] = self.nearest(candidates, path)
+        return cl
+
+    def nearest(self, candidates, path):
+        by_path = {}
+        for cl in candidates:
+            by_path.setdefault(node_path(cl), cl)
+        if path in by_path:
+            return by_path[path]
+        unit = self.units_by_path.get(path)
+        if unit is not None:
+            for inc in unit.includes:
+                cl = by_path.get(inc.includedfile.filepath)
+                if cl is not None:
+                    return cl
+        dirs = path.split('/')[:-1]
+        best, best_length = candidates[0], 0
+        for p, cl in by_path.items():
+            if p is None:
+                continue
+            length = len(posixpath.commonprefix([p.split('/')[:-1], dirs]))
+            if length > best_length:
+                best, best_length = cl, length
+        return best
+
+def node_path(node):
+    """The path of the unit a node is in, if it is known."""
+    anchor = node.sourceAnchor
+    if anchor is None:
+        return getattr(node, 'path', None)
+    return anchor.unit.filepath
+
+class Alias(object):
+    """A typedef or using alias.  Aliases are not in the model, but are
+    indexed like classes to find the type a name stands for."""
+    __slots__ = ('key', 'name', 'target', 'context', 'path', 'sourceAnchor')
+    def __init__(self, key, name, target, context, path):
+        self.key = key
+        self.name = name
+        self.target = target
+        self.context = context
+        self.path = path
+        self.sourceAnchor = None
+
+class TypeResolver(object):
+    """Find the class a declared type refers to.  Each spelling of a
+    type is normalised once by normalize_type(), and the name found is
+    looked up as a class, or else as an alias whose target is resolved
+    in turn from where the alias was declared."""
+
+    max_depth = 8
+
+    def __init__(self, classes, aliases, wrappers=()):
+        wrappers = default_type_wrappers + tuple(wrappers)
+        self.classes = classes
+        self.aliases = aliases
+        self.wrappers = frozenset(w for w in wrappers if not w.endswith('::'))
+        self.prefixes = tuple(w for w in wrappers if w.endswith('::'))
+        self.normal = {}   # spelling -> normalised name
+
+    def normalize(self, spelling):
+        name = self.normal.get(spelling)
+        if name is None:
+            name = self.normal[spelling] = normalize_type(
+                spelling, self.wrappers, self.prefixes)
+        return name
+
+    def resolve(self, name, context=global_context, path=None, depth=0):
+        """The class for the normalised type `name` used in `context`."""
+        cl = self.classes.find(name, context, path)
+        if cl is None and self.aliases.by_key and depth < self.max_depth:
+            alias = self.aliases.find(name, context, path)
+            if alias is not None:
+                cl = self.resolve(self.normalize(alias.target), alias.context,
+                                  alias.path, depth + 1)
+        return cl
+
+class CallResolver(object):
+    """Find the function or method called by a call, from the name it
+    is called by, its number of arguments and the class of the caller.
+    Methods are looked for in the class and then up its inheritance
+    chain, the nearest class declaring the name hiding those above it
+    as in C++.  Calls on a member variable are looked for in the class
+    of the variable.  Lookups go through hashed indexes and are
+    memoized, since the same names are called from the same classes
+    over and over."""
+
+    def __init__(self, classes, functions_by_name):
+        self.classes = classes
+        self.functions_by_name = functions_by_name
+        self.functions_by_scope = {}   # (namespace, name) -> overloads
+        for name, overloads in functions_by_name.items():
+            for f in overloads:
+                self.functions_by_scope.setdefault((f.context[0], name),
+                                                   []).append(f)
+        self.method_names = set()
+        for cl in classes.values():
+            self.method_names.update(cl.methods_by_name)
+        self.found = {}
+        self.methods = {}     # (class, name) -> nearest overloads
+        self.variables = {}   # (class, name) -> class of the variable
+        self.variable_types = {}
+
+    def resolve(self, sender, callee, nargs):
+        if not callee:
+            return None
+        if isinstance(sender, Method):
+            cl = sender.classclass
+            context = cl.context
+        else:
+            cl = None
+            context = sender.context
+        key = (cl, context, callee, nargs)
+        try:
+            return self.found[key]
+        except KeyError:
+            result = self.found[key] = self.lookup(cl, context, callee,
+                                                   nargs)
+            return result
+
+    def lookup(self, cl, context, callee, nargs):
+        m = callee_parts.match(strip_template_args(callee))
+        if m is None:
+            return None
+        scope, separator, name = m.groups()
+        scope = qualified_name(scope)
+        if not scope:
+            if cl is not None:
+                met = self.find_method(cl, name, nargs)
+                if met is not None:
+                    return met
+            return self.find_function('', name, nargs, context)
+        if separator == '::':
+            # A static or base class method, or a function in a namespace
+            owner = self.classes.find(scope, context)
+            if owner is not None:
+                return self.find_method(owner, name, nargs)
+            return self.find_function(scope, name, nargs, context)
+        if cl is None:
+            return None
+        if scope in ('this', '(*this)', '*this'):
+            return self.find_method(cl, name, nargs)
+        owner = self.variable_class(cl, scope)
+        if owner is not None:
+            return self.find_method(owner, name, nargs)
+        return None
+
+    def inherited(self, table, cl, name, own):
+        """The nearest `own(c, name)` up the inheritance chain of `cl`.
+        Every class passed on the way remembers the answer, so a chain
+        is only walked once per name."""
+        path = []
+        result = None
+        c = cl
+        while c is not None:
+            key = (c, name)
+            if key in table:
+                result = table[key]
+                break
+            # Marked before looking further, so a cycle ends here
+            table[key] = None
+            path.append(key)
+            result = own(c, name)
+            if result is not None:
+                break
+            supers = [inh.superclass for inh in c.inheritances.values()]
+            if len(supers) == 1:
+                c = supers[0]
+                continue
+            for s in supers:
+                result = self.inherited(table, s, name, own)
+                if result is not None:
+                    break
+            break
+        for key in path:
+            table[key] = result
+        return result
+
+    def find_method(self, cl, name, nargs):
+        if name not in self.method_names:
+            return None
+        overloads = self.inherited(self.methods, cl, name,
+                                   lambda c, n: c.methods_by_name.get(n))
+        return best_overload(overloads, nargs)
+
+    def find_function(self, namespace, name, nargs, context):
+        """The function `namespace::name` as called from `context`,
+        looking in the nearest enclosing namespace first.  Unqualified
+        calls fall back to a function with that name anywhere."""
+        overloads = self.functions_by_name.get(name)
+        if not overloads:
+            return None
+        if namespace:
+            namespace = namespace.lstrip(':') + '::'
+        for prefix in context:
+            near = self.functions_by_scope.get((prefix + namespace, name))
+            if near is not None:
+                f = best_overload(near, nargs)
+                if f is not None:
+                    return f
+        if namespace:
+            return None
+        return best_overload(overloads, nargs)
+
+    def own_variable(self, cl, name):
+        types = self.variable_types.get(cl)
+        if types is None:
+            types = self.variable_types[cl] = {}
+            for attr in cl.variables:
+                if (isinstance(attr.declaredType, Class)
+                        and attr.name not in types):
+                    types[attr.name] = attr.declaredType
+        return types.get(name)
+
+    def variable_class(self, cl, name):
+        return self.inherited(self.variables, cl, name, self.own_variable)
+
+def accepts(arity, nargs):
+    if arity is None or nargs is None:
+        return True
+    low, high = arity
+    return low <= nargs and (high is None or nargs <= high)
+
+def best_overload(overloads, nargs):
+    """The first overload taking `nargs` arguments, or the only one."""
+    if not overloads:
+        return None
+    for f in overloads:
+        if accepts(f.arity, nargs):
+            return f
+    return overloads[0] if len(overloads) == 1 else None
+
+# The name a function is called by: something it is called on or in,
+# followed by ., -> or ::, and the name
+callee_parts = re.compile(r'^(.*?)(::|\.|->)?\s*(~?\w+|operator\W+)$', re.S)
+
+class IncludeIndex(object):
+    """Find the unit named by an #include the way a compiler would:
+    relative to the including file for quoted includes, then in each
+    search path.  Failing that, the unit whose path ends with the
+    included name is used, and if there are several, the one sharing
+    the longest directory prefix with the including file."""
+
+    def __init__(self, units, search_paths=()):
+        self.by_path = {}
+        self.by_suffix = {}  # trailing path components -> units
+        for u in units:
+            path = posixpath.normpath(u.filepath)
+            self.by_path[path] = u
+            parts = path.split('/')
+            for i in range(len(parts)):
+                self.by_suffix.setdefault('/'.join(parts[i:]), []).append(u)
+        self.search_paths = [posixpath.normpath(p) for p in search_paths]
+        # Files in the same directory resolve a name the same way
+        self.found = {}
+        # For ambiguous names, directory -> first unit below it
+        self.nearest = {}
+
+    def find(self, includer, name, angled=False):
+        """Return the included unit, or None if it is not part of the
+        input, and whether the name was ambiguous."""
+        if not name:
+            return None, False
+        here = posixpath.dirname(posixpath.normpath(includer))
+        key = (here, name, angled)
+        result = self.found.get(key)
+        if result is None:
+            result = self.found[key] = self.lookup(here, name, angled)
+        return result
+
+    def lookup(self, here, name, angled):
+        name = posixpath.normpath(name)
+        if not angled:
+            u = self.by_path.get(posixpath.normpath(posixpath.join(here,
+                                                                   name)))
+            if u is not None:
+                return u, False
+        for root in self.search_paths:
+            u = self.by_path.get(posixpath.normpath(posixpath.join(root,
+                                                                   name)))
+            if u is not None:
+                return u, False
+        parts = name.split('/')
+        while parts and parts[0] in ('.', '..'):
+            parts.pop(0)
+        suffix = '/'.join(parts)
+        candidates = self.by_suffix.get(suffix)
+        if not candidates:
+            return None, False
+        if len(candidates) == 1:
+            return candidates[0], False
+        nearest = self.nearest.get(suffix)
+        if nearest is None:
+            nearest = self.nearest[suffix] = {}
+            for u in candidates:
+                dirs = posixpath.normpath(u.filepath).split('/')[:-1]
+                for i in range(len(dirs)+1):
+                    nearest.setdefault('/'.join(dirs[:i]), u)
+        dirs = here.split('/') if here else []
+        for i in range(len(dirs), -1, -1):
+            u = nearest.get('/'.join(dirs[:i]))
+            if u is not None:
+                return u, True
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, if known."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss*1024
+
+def current_rss():
+    """Resident memory of this process in bytes, or the peak where the
+    current size cannot be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return peak_rss()
+
+def top_functions(profile, n=10):
+    """The functions with the most time spent in them."""
+    rows = sorted(pstats.Stats(profile).stats.items(),
+                  key=lambda row: row[1][2], reverse=True)[:n]
+    return [{'function': '%s:%d(%s)'%func, 'calls': nc,
+             'tottime': tt, 'cumtime': ct}
+            for func, (cc, nc, tt, ct, callers) in rows]
+
+class Progress(object):
+    """Shows on stderr how far a phase has got, its rate and the time
+    left, at most every `interval` seconds."""
+
+    def __init__(self, label, total, unit, enabled=True, interval=0.5):
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.enabled = enabled
+        self.interval = interval
+        self.start = self.last = time.time()
+        self.shown = False
+
+    def update(self, done, items):
+        """`done` counts towards `total`, `items` are the units of
+        work for the rate, which may be different (units while reading
+        bytes of the input)."""
+        if not self.enabled:
+            return
+        now = time.time()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        elapsed = now - self.start
+        line = '%s: %d %s, %.0f %s/s'%(self.label, items, self.unit,
+                                        items/elapsed, self.unit)
+        if self.total and done:
+            fraction = min(1.0, float(done)/self.total)
+            left = int(elapsed*(1 - fraction)/fraction)
+            line += ', %d%%, ETA %d:%02d:%02d'%(100*fraction, left//3600,
+                                                 left//60%60, left%60)
+        sys.stderr.write('\r%-79s'%line)
+        sys.stderr.flush()
+        self.shown = True
+
+    def finish(self):
+        if self.shown:
+            sys.stderr.write('\n')
+            sys.stderr.flush()
+
+class PhaseStats(object):
+    """Time taken by each phase of the conversion, the peak memory use
+    at its end, and the number of entities found, which --stats saves
+    as JSON.  Each phase can also be profiled with cProfile, have its
+    Python allocations traced with tracemalloc, and show its progress."""
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.counts = collections.OrderedDict()
+        self.profile = False
+        self.trace_memory = False
+        self.show_progress = False
+        self.profiles = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        profile = cProfile.Profile() if self.profile else None
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            traced = tracemalloc.get_traced_memory()[0]
+        start = time.time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            record = {'seconds': time.time() - start,
+                      'peak_rss': peak_rss()}
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record['traced_memory'] = current - traced
+                record['traced_peak'] = peak
+                record['allocations'] = [
+                    {'line': str(s.traceback), 'size': s.size,
+                     'count': s.count}
+                    for s in tracemalloc.take_snapshot().statistics(
+                        'lineno')[:10]]
+            if profile is not None:
+                record['profile'] = top_functions(profile)
+                self.profiles.append(profile)
+            self.phases[name] = record
+
+    def progress(self, label, total, unit):
+        return Progress(label, total, unit, enabled=self.show_progress)
+
+    def count(self, name, n):
+        self.counts[name] = n
+
+    def report(self):
+        """Print the hot spots of each phase found by the profiler."""
+        for name, record in self.phases.items():
+            if 'profile' not in record:
+                continue
+            print('Hot spots in %s (%.2f s):'%(name, record['seconds']))
+            for f in record['profile'][:5]:
+                print('  %8.3f s %8d calls  %s'%(f['tottime'], f['calls'],
+                                                 f['function']))
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'phases': self.phases, 'counts': self.counts},
+                      f, indent=2)
+
+    def save_profile(self, filename):
+        if self.profiles:
+            pstats.Stats(*self.profiles).dump_stats(filename)
+
+class MSEWriter(object):
+    """Buffered writer for MSE and other text output.  Text is collected
+    in memory and written out in large chunks, compressed with one of
+    `compressions` if `compress` names it.  If compressing with several
+    threads, each chunk is compressed to its own stream in a thread pool
+    and the streams are written in order, which readers of all these
+    formats see as a single file.  The output is a file name or a binary
+    file, which is left open."""
+
+    def __init__(self, output, compress=None, compress_level=9,
+                 threads=0, chunk_size=1<<22):
+        self.parts = []
+        self.size = 0
+        self.chunk_size = chunk_size
+        self.compress_level = compress_level
+        self.threads = threads
+        self.executor = None
+        self.owned = not hasattr(output, 'write')
+        self.output = open(output, 'wb') if self.owned else output
+        self.compression = (compressions[compress]
+                            if compress not in (None, 'none') else None)
+        if self.compression is not None and threads > 0:
+            self.file = self.output
+            self.executor = ThreadPoolExecutor(threads)
+            self.pending = collections.deque()
+        elif self.compression is not None:
+            self.file = self.compression.open(self.output, 'wb',
+                                              compress_level)
+        else:
+            self.file = self.output
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def write_node(self, node):
+        self.write(node.to_mse())
+        self.write('\n')
+
+    def flush(self):
+        data = ''.join(self.parts).encode('UTF-8')
+        self.parts = []
+        self.size = 0
+        if self.executor is None:
+            self.file.write(data)
+            return
+        self.pending.append(self.executor.submit(self.compression.compress,
+                                                 data, self.compress_level))
+        while len(self.pending) > 2*self.threads:
+            self.file.write(self.pending.popleft().result())
+
+    def close(self):
+        self.flush()
+        if self.executor is not None:
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+            self.executor.shutdown()
+        if self.file is not self.output:
+            self.file.close()
+        if self.owned:
+            self.output.close()
+
+# Nodes are kept in the order they are made, which is the order they
+# are written in.  With a memory budget, the nodes that will not change
+# any more are spilled to a temporary segment file as marshalled
+# records once the process goes over it, and read back when the model
+# is written.  The nodes other nodes are still resolved against, such
+# as classes and methods, stay in memory through the indexes.
+
+class Ref(Node):
+    """A reference read back from a segment file."""
+    __slots__ = ()
+    def __init__(self, id):
+        self.id = id
+
+class SpilledNode(Node):
+    """A node read back from a segment file, with the attributes it had
+    when it was spilled."""
+    __slots__ = ('attributes',)
+    def __init__(self, record):
+        self.id, self.mse_node_type, values = record
+        self.sourceAnchor = None
+        self.attributes = [(name, Ref(v[0]) if type(v) is tuple else v)
+                           for name, v in values]
+    def all_attribs(self):
+        return self.attributes
+
+def node_values(node):
+    """A node as a record for a segment file, with the nodes it refers
+    to replaced by a tuple of their id."""
+    return (node.id, node.mse_node_type,
+            [(name, (v.id,) if isinstance(v, Node) else v)
+             for name, v in node.all_attribs()])
+
+class NodeBuffer(object):
+    """The nodes of a model in order.  finish() tells that the nodes
+    added so far are final, and spills them if the process uses more
+    than `max_memory` bytes.  The segment file is a sequence of
+    marshalled lists of records, each preceded by its length.
+    Iterating gives the spilled nodes, as SpilledNode, then those still
+    in memory."""
+
+    check_interval = 1<<14   # nodes added between memory checks
+    batch_size = 4096        # records per marshalled list
+
+    def __init__(self, max_memory=None):
+        self.max_memory = max_memory
+        self.nodes = []
+        self.final = 0
+        self.checked = 0
+        self.spilled = 0
+        self.segment = None
+
+    def __len__(self):
+        return self.spilled + len(self.nodes)
+
+    def append(self, node):
+        self.nodes.append(node)
+
+    def finish(self):
+        self.final = len(self.nodes)
+        if (self.max_memory is None
+                or len(self) - self.checked < self.check_interval):
+            return
+        self.checked = len(self)
+        rss = current_rss()
+        if rss is not None and rss > self.max_memory:
+            self.spill()
+
+    def spill(self):
+        if self.segment is None:
+            self.segment = tempfile.TemporaryFile(prefix='srcml-to-mse-')
+        nodes = self.nodes
+        for i in range(0, self.final, self.batch_size):
+            end = min(i + self.batch_size, self.final)
+            data = marshal.dumps([node_values(n) for n in nodes[i:end]])
+            self.segment.write(struct.pack('<Q', len(data)))
+            self.segment.write(data)
+        del nodes[:self.final]
+        self.spilled += self.final
+        self.final = 0
+
+    def __iter__(self):
+        if self.segment is not None:
+            self.segment.seek(0)
+            while True:
+                header = self.segment.read(8)
+                if not header:
+                    break
+                (length,) = struct.unpack('<Q', header)
+                for record in marshal.loads(self.segment.read(length)):
+                    yield SpilledNode(record)
+            self.segment.seek(0, io.SEEK_END)
+        for n in self.nodes:
+            yield n
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+class FactBuffer(object):
+    """The facts of the units in order.  If the process uses more than
+    `max_memory` bytes while they are loaded, the calls of the units
+    held so far, by far the largest part of their facts, are moved to a
+    segment file as for NodeBuffer and their facts.calls set to None.
+    calls() gives them back in order."""
+
+    check_interval = 256   # units added between memory checks
+
+    def __init__(self, max_memory=None):
+        self.max_memory = max_memory
+        self.facts = []
+        self.held = 0          # first unit whose calls are in memory
+        self.checked = 0
+        self.segment = None
+
+    def __len__(self):
+        return len(self.facts)
+
+    def __iter__(self):
+        return iter(self.facts)
+
+    def append(self, facts):
+        self.facts.append(facts)
+        if (self.max_memory is None
+                or len(self.facts) - self.checked < self.check_interval):
+            return
+        self.checked = len(self.facts)
+        rss = current_rss()
+        if rss is not None and rss > self.max_memory:
+            self.spill()
+
+    def spill(self):
+        if self.segment is None:
+            self.segment = tempfile.TemporaryFile(prefix='srcml-to-mse-')
+        for facts in self.facts[self.held:]:
+            data = marshal.dumps(facts.calls)
+            self.segment.write(struct.pack('<Q', len(data)))
+            self.segment.write(data)
+            facts.calls = None
+        self.held = len(self.facts)
+
+    def calls(self):
+        """Yield the facts of each unit with its calls, which are then
+        released."""
+        if self.segment is not None:
+            self.segment.seek(0)
+        for facts in self.facts:
+            calls = facts.calls
+            if calls is None:
+                (length,) = struct.unpack('<Q', self.segment.read(8))
+                calls = marshal.loads(self.segment.read(length))
+            facts.calls = ()
+            yield facts, calls
+        self.close()
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+# Output formats.  Besides MSE, the model can be written as JSON lines,
+# one object per node, as an SQLite database, or as a binary columnar
+# file, so that other tools can query it without parsing MSE.  In all
+# of them references to other nodes are given by their id.
+
+class Exporter(object):
+    """Writes the nodes of a model to a file in one format.  Nodes are
+    given to write_node() in the order of the model, and close()
+    finishes the file.  `suffix` is the extension of the files it
+    writes, and `compressible` whether it can compress them."""
+    suffix = None
+    compressible = False
+
+    def write_node(self, node):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class MSEExporter(Exporter):
+    suffix = '.mse'
+    compressible = True
+
+    def __init__(self, output, **options):
+        self.writer = MSEWriter(output, **options)
+        self.writer.write('(\n')
+
+    def write_node(self, node):
+        self.writer.write_node(node)
+
+    def close(self):
+        self.writer.write(')\n')
+        self.writer.close()
+
+def node_record(node):
+    """The attributes of a node as a dict, with nodes replaced by ids."""
+    record = {'id': node.id, 'type': node.mse_node_type}
+    for name, v in node.all_attribs():
+        record[name] = v.id if isinstance(v, Node) else v
+    return record
+
+class JSONLinesExporter(Exporter):
+    suffix = '.jsonl'
+    compressible = True
+
+    def __init__(self, output, **options):
+        self.writer = MSEWriter(output, **options)
+        self.encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    def write_node(self, node):
+        self.writer.write(self.encode(node_record(node)))
+        self.writer.write('\n')
+
+    def close(self):
+        self.writer.close()
+
+# Tables of the SQLite and columnar outputs: for each type of node, the
+# table name and its columns, besides the id, with the kind of value
+# in each column.  Attributes not listed here are not written.
+node_tables = collections.OrderedDict([
+    ('FAMIX.Package', ('packages', [('name', 'str')])),
+    ('FAMIX.CompilationUnit', ('compilation_units', [
+        ('filepath', 'str'), ('name', 'str'), ('language', 'str')])),
+    ('FAMIX.Header', ('headers', [
+        ('filepath', 'str'), ('name', 'str'), ('language', 'str')])),
+    ('FAMIX.Include', ('includes', [('source', 'ref'), ('target', 'ref')])),
+    ('FAMIX.FileAnchor', ('file_anchors', [
+        ('element', 'ref'), ('unit', 'ref'), ('fileName', 'str'),
+        ('startLine', 'int'), ('endLine', 'int')])),
+    ('FAMIX.Class', ('classes', [
+        ('name', 'str'), ('belongsToPackage', 'ref'),
+        ('sourceAnchor', 'ref')])),
+    ('FAMIX.Inheritance', ('inheritances', [
+        ('subclass', 'ref'), ('superclass', 'ref')])),
+    ('FAMIX.Method', ('methods', [
+        ('name', 'str'), ('signature', 'str'), ('parentType', 'ref'),
+        ('declaredType', 'ref'), ('sourceAnchor', 'ref')])),
+    ('FAMIX.Attribute', ('attributes', [
+        ('name', 'str'), ('parentType', 'ref'), ('declaredType', 'ref'),
+        ('sourceAnchor', 'ref')])),
+    ('FAMIX.Function', ('functions', [
+        ('name', 'str'), ('signature', 'str'), ('declaredType', 'ref'),
+        ('sourceAnchor', 'ref')])),
+    ('FAMIX.Invocation', ('invocations', [
+        ('signature', 'str'), ('sender', 'ref'), ('receiver', 'ref'),
+        ('callCount', 'int'), ('sourceAnchor', 'ref')])),
+])
+
+# Columns indexed in the SQLite output
+sqlite_indexes = [('compilation_units', 'filepath'), ('headers', 'filepath'),
+                  ('includes', 'source'), ('includes', 'target'),
+                  ('classes', 'name'), ('inheritances', 'subclass'),
+                  ('inheritances', 'superclass'), ('methods', 'name'),
+                  ('methods', 'parentType'), ('attributes', 'parentType'),
+                  ('functions', 'name'), ('invocations', 'sender'),
+                  ('invocations', 'receiver')]
+
+sqlite_types = {'str': 'TEXT', 'ref': 'INTEGER', 'int': 'INTEGER',
+                'bool': 'INTEGER'}
+
+def node_row(node, columns):
+    record = node_record(node)
+    return [node.id] + [record.get(name) for name, kind in columns]
+
+class SQLiteExporter(Exporter):
+    """Writes a table for each type of node, inserting rows in batches
+    in a single transaction and adding the indexes at the end."""
+    suffix = '.sqlite'
+
+    def __init__(self, output, batch_size=10000, **options):
+        if hasattr(output, 'write'):
+            raise ValueError('SQLite output must be a file name')
+        if os.path.exists(output):
+            os.remove(output)
+        self.db = sqlite3.connect(output)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.batch_size = batch_size
+        self.rows = {}
+        for mse_type, (table, columns) in node_tables.items():
+            self.db.execute('CREATE TABLE %s (id INTEGER PRIMARY KEY, %s)'
+                            %(table, ', '.join('%s %s'%(name,
+                                                         sqlite_types[kind])
+                                               for name, kind in columns)))
+            self.rows[mse_type] = []
+
+    def write_node(self, node):
+        rows = self.rows.get(node.mse_node_type)
+        if rows is None:
+            return
+        rows.append(node_row(node, node_tables[node.mse_node_type][1]))
+        if len(rows) >= self.batch_size:
+            self.flush(node.mse_node_type)
+
+    def flush(self, mse_type):
+        table, columns = node_tables[mse_type]
+        self.db.executemany('INSERT INTO %s VALUES (%s)'
+                            %(table, ', '.join('?'*(len(columns) + 1))),
+                            self.rows[mse_type])
+        self.rows[mse_type] = []
+
+    def close(self):
+        for mse_type in node_tables:
+            self.flush(mse_type)
+        for table, column in sqlite_indexes:
+            self.db.execute('CREATE INDEX %s_%s ON %s (%s)'
+                            %(table, column, table, column))
+        self.db.commit()
+        self.db.close()
+
+# The columnar file is the magic number, then the data of each column,
+# then a JSON footer giving the position of each column, followed by
+# the length of the footer as a little-endian 64-bit integer.  Numbers
+# and references are little-endian 64-bit integers, booleans bytes, and
+# strings 32-bit indexes into a table of unique strings, -1 standing
+# for a missing value.  The string table is stored as the 64-bit
+# offsets of each string, and one more for the end, in a block of
+# UTF-8 text.
+
+columnar_magic = b'MSECOL\x00\x01'
+columnar_codes = {'str': 'i', 'ref': 'q', 'int': 'q', 'bool': 'b'}
+
+def little_endian(a):
+    if sys.byteorder == 'big':
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+class ColumnarExporter(Exporter):
+    """Appends each attribute of a node to the array of its column,
+    which is much smaller than the nodes, and writes the arrays out at
+    the end."""
+    suffix = '.msecol'
+
+    def __init__(self, output, **options):
+        self.owned = not hasattr(output, 'write')
+        self.file = open(output, 'wb') if self.owned else output
+        self.strings = {}
+        self.columns = {}
+        for mse_type, (table, columns) in node_tables.items():
+            self.columns[mse_type] = [array.array('q')] + [
+                array.array(columnar_codes[kind]) for name, kind in columns]
+
+    def string(self, s):
+        i = self.strings.get(s)
+        if i is None:
+            i = self.strings[s] = len(self.strings)
+        return i
+
+    def write_node(self, node):
+        arrays = self.columns.get(node.mse_node_type)
+        if arrays is None:
+            return
+        columns = node_tables[node.mse_node_type][1]
+        row = node_row(node, columns)
+        arrays[0].append(row[0])
+        for a, (name, kind), v in zip(arrays[1:], columns, row[1:]):
+            if v is None:
+                a.append(-1)
+            elif kind == 'str':
+                a.append(self.string(v))
+            else:
+                a.append(v)
+
+    def close(self):
+        f = self.file
+        f.write(columnar_magic)
+        offset = [len(columnar_magic)]
+        def block(data):
+            f.write(data)
+            start = offset[0]
+            offset[0] += len(data)
+            return [start, len(data)]
+        tables = collections.OrderedDict()
+        for mse_type, (table, columns) in node_tables.items():
+            arrays = self.columns[mse_type]
+            tables[table] = {
+                'type': mse_type, 'rows': len(arrays[0]),
+                'columns': [[name, kind] + block(little_endian(a))
+                            for (name, kind), a in zip([('id', 'int')]
+                                                       + columns, arrays)]}
+        data = [s.encode('UTF-8') for s in self.strings]
+        offsets = array.array('q', [0])
+        for d in data:
+            offsets.append(offsets[-1] + len(d))
+        footer = {'tables': tables,
+                  'strings': {'count': len(data),
+                              'offsets': block(little_endian(offsets)),
+                              'data': block(b''.join(data))}}
+        footer = json.dumps(footer).encode('UTF-8')
+        f.write(footer)
+        f.write(struct.pack('<Q', len(footer)))
+        if self.owned:
+            f.close()
+
+def read_columnar(filename):
+    """Read a columnar file written by ColumnarExporter, returning for
+    each table a dict of its columns as lists."""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(columnar_magic):
+        raise ValueError('%s is not a columnar MSE file'%filename)
+    (length,) = struct.unpack('<Q', data[-8:])
+    footer = json.loads(data[-8-length:-8].decode('UTF-8'))
+    def block(code, position):
+        a = array.array(code)
+        a.frombytes(data[position[0]:position[0]+position[1]])
+        if sys.byteorder == 'big':
+            a.byteswap()
+        return a
+    strings = footer['strings']
+    offsets = block('q', strings['offsets'])
+    start = strings['data'][0]
+    strings = [data[start+offsets[i]:start+offsets[i+1]].decode('UTF-8')
+               for i in range(strings['count'])]
+    tables = collections.OrderedDict()
+    for table, t in footer['tables'].items():
+        columns = collections.OrderedDict()
+        for name, kind, offset, size in t['columns']:
+            values = block(columnar_codes[kind], (offset, size))
+            if kind == 'str':
+                columns[name] = [strings[v] if v >= 0 else None
+                                 for v in values]
+            elif kind == 'bool':
+                columns[name] = [bool(v) if v >= 0 else None for v in values]
+            else:
+                columns[name] = [v if v >= 0 else None for v in values]
+        tables[table] = columns
+    return tables
+
+exporters = collections.OrderedDict([
+    ('mse', MSEExporter),
+    ('jsonl', JSONLinesExporter),
+    ('sqlite', SQLiteExporter),
+    ('columnar', ColumnarExporter),
+])
+
+def output_compression(filename):
+    """The compression of an output file, from its name."""
+    for c in compressions.values():
+        if filename.endswith(c.suffix):
+            return c.name
+    return None
+
+def input_name(input):
+    """The name of a SrcML file given as a name or a binary file, which
+    the output is named after if not given."""
+    if not hasattr(input, 'read'):
+        return input
+    name = getattr(input, 'name', None)
+    if not isinstance(name, str):
+        raise ValueError('an output must be given for an input file '
+                         'without a name')
+    return name
+
+def output_filename(input_filename, compress=None, format='mse'):
+    """The file written for a SrcML file: the same name with the .xml
+    extension replaced by that of the format, and the suffix of
+    `compress`.  By default the output is compressed with bzip2 if the
+    input name shows it is compressed and the format can be."""
+    exporter = exporters[format]
+    base, ext = os.path.splitext(input_filename)
+    compressed = ext in compressed_suffixes
+    if compressed:
+        base = os.path.splitext(base)[0]
+    if compress is None:
+        compress = 'bz2' if compressed else 'none'
+    if compress == 'none' or not exporter.compressible:
+        return base + exporter.suffix
+    return base + exporter.suffix + compressions[compress].suffix
+
+# Diff mode.  Two snapshots of a code base are compared unit by unit.
+# Units with the same hash in both are skipped, and the entities of the
+# others are matched by an identity made of the unit path and their
+# qualified names or signatures as written, which does not depend on
+# the order nodes are numbered in.
+
+sqlite_magic = b'SQLite format 3\x00'
+
+def is_fact_store(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(sqlite_magic)) == sqlite_magic
+
+def snapshot_units(input, accept=None, threads=0):
+    """Yield the path, hash, element and XML of each unit of a SrcML
+    file name or binary file."""
+    input_file, source = open_input(input, threads)
+    try:
+        for unit in iter_units(source, accept):
+            xml = etree.tostring(unit, with_tail=False)
+            yield unit.attrib['filename'], unit_key(xml), unit, xml
+    finally:
+        if source is not input_file:
+            source.close()
+        if not hasattr(input, 'read'):
+            input_file.close()
+
+def srcml_snapshot(input, kinds=entity_kinds, accept=None, threads=0):
+    """The hash of each unit of a SrcML file, and a function giving the
+    facts of the units with some paths as {path: facts}.  Only the
+    hashes are kept from a first reading of the file, which is read
+    again for the facts of the units asked for."""
+    hashes = collections.OrderedDict(
+        (path, key) for path, key, unit, xml
+        in snapshot_units(input, accept, threads))
+    def facts(paths):
+        paths = frozenset(paths)
+        found = {}
+        if not paths:
+            return found
+        if hasattr(input, 'seek'):
+            input.seek(0)
+        wanted = lambda unit: unit.attrib['filename'] in paths
+        for path, key, unit, xml in snapshot_units(input, wanted, threads):
+            found[path] = unit_facts(unit, xml, kinds)
+        return found
+    return hashes, facts
+
+def stored_snapshot(filename, accept=None):
+    """The hash of each unit in a fact store written with --cache, and
+    a function reading the facts of the units with some paths as
+    {path: facts}."""
+    db = sqlite3.connect(filename)
+    (version,) = db.execute('PRAGMA user_version').fetchone()
+    if version != FactCache.version:
+        raise ValueError('%s was written by another version of the '
+                         'converter'%filename)
+    hashes = collections.OrderedDict(
+        (path, key) for path, key in
+        db.execute('SELECT filename, hash FROM facts ORDER BY filename')
+        if accept is None or accept.match(path))
+    def facts(paths):
+        found = {}
+        for path in paths:
+            row = db.execute('SELECT facts FROM facts WHERE filename=?',
+                             (path,)).fetchone()
+            if row is None:
+                continue
+            facts = pickle.loads(row[0])
+            if accept is None or accept.match(path, facts.language):
+                found[path] = facts
+        return found
+    return hashes, facts
+
+def sender_identity(sender):
+    if sender[0] == 'method':
+        kind, class_key, method_name, method_sig, params = sender
+        return ('method', class_key, method_sig)
+    (kind, context, signature, class_name, method_name, method_sig,
+     params) = sender
+    if class_name is not None:
+        return ('method', class_name, method_sig)
+    return ('function', context[0], signature)
+
+def fact_entities(facts, kinds=entity_kinds):
+    """The entities found in a unit, by identity, with the attributes
+    compared between snapshots.  Lines are left out, as any edit above
+    an entity changes them."""
+    path = facts.path
+    entities = collections.OrderedDict()
+    if 'includes' in kinds:
+        for fn, angled in facts.includes:
+            entities[('include', path, fn)] = {'angled': angled}
+    if 'classes' in kinds:
+        for cf in facts.classes:
+            entities[('class', path, cf.key)] = {
+                'supers': sorted(cf.supers),
+                'variables': dict(cf.variables)}
+            for s in cf.supers:
+                entities[('inheritance', path, cf.key, s)] = {}
+            for name, sig, ty, arity, lines, params in cf.methods:
+                entities[('method', path, cf.key, sig)] = {'type': ty}
+    if 'functions' in kinds:
+        for name, sig, ty, arity, lines, context in facts.functions:
+            entities[('function', path, context[0], sig)] = {'type': ty}
+    if 'invocations' in kinds:
+        for signature, sender, callee, nargs, lines in facts.calls:
+            key = ('invocation', path, sender_identity(sender), signature)
+            inv = entities.get(key)
+            if inv is None:
+                inv = entities[key] = {'count': 0}
+            inv['count'] += 1
+    return entities
+
+def diff_entities(old, new):
+    """Yield (change, identity, old attributes, new attributes) for the
+    entities added, removed or changed between two dicts of entities."""
+    for key, attrs in new.items():
+        before = old.get(key)
+        if before is None:
+            yield 'added', key, None, attrs
+        elif before != attrs:
+            yield 'changed', key, before, attrs
+    for key, attrs in old.items():
+        if key not in new:
+            yield 'removed', key, attrs, None
+
+def diff_filename(input_filename, compress=None):
+    """The file written by diff mode for a SrcML file."""
+    name = output_filename(input_filename, compress, 'jsonl')
+    head, suffix, tail = name.rpartition('.jsonl')
+    return head + '.diff.jsonl' + tail
+
+class Converter(object):
+    """Convert SrcML documents to MSE.  The model being built is kept
+    here rather than in globals, and is reset by each call to convert(),
+    so that many documents can be converted in one process."""
+
+    def __init__(self, package='Siconos', include_paths=(), jobs=1,
+                 cache=None, compress=None, compress_level=9,
+                 compress_threads=0, decompress_threads=0, format='mse',
+                 aggregate_calls=False, resolve_calls=False, type_wrappers=(),
+                 max_memory=None, paths=(), exclude=(), languages=(),
+                 entities=entity_kinds, stats=None, verbose=True):
+        self.package = package
+        self.include_paths = list(include_paths)
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.cache = cache
+        self.compress = compress
+        self.decompress_threads = decompress_threads
+        self.format = format
+        self.aggregate_calls = aggregate_calls
+        self.resolve_calls = resolve_calls
+        self.type_wrappers = tuple(type_wrappers)
+        self.max_memory = max_memory
+        self.paths = list(paths)
+        self.exclude = list(exclude)
+        self.languages = list(languages)
+        self.entities = entity_closure(entities)
+        self.compress_level = compress_level
+        self.compress_threads = compress_threads
+        self.stats = stats if stats is not None else PhaseStats()
+        self.verbose = verbose
+        self.reset()
+
+    def reset(self):
+        if getattr(self, 'nodes', None) is not None:
+            self.nodes.close()
+        self.id_counter = 0
+        self.nodes = NodeBuffer(self.max_memory)
+        self.functions = {}     # (namespace, signature) -> function
+        self.functions_by_name = {}
+        self.units_by_path = {}
+        self.classes = ClassIndex(self.units_by_path)
+        self.aliases = ClassIndex(self.units_by_path)
+        self.headers = {}
+        self.n_invocations = 0
+        self.unresolved = []
+
+    def new_id(self):
+        i = self.id_counter
+        self.id_counter += 1
+        return i
+
+    def log(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def convert(self, input, output=None):
+        """Convert the SrcML file name or binary file `input`, and write
+        the model to `output` in the converter's format, by default to a
+        file named after the input, or after its `name` for a binary
+        file.  Returns the output."""
+        if output is None:
+            output = output_filename(input_name(input), self.compress,
+                                     self.format)
+        self.reset()
+        self.link(self.load(input))
+        with self.stats.phase('output'):
+            self.write(output)
+        self.stats.count('nodes', len(self.nodes))
+        self.stats.count('spilled_nodes', self.nodes.spilled)
+        return output
+
+    def diff(self, old, new, output=None):
+        """Compare the SrcML file `new` with an earlier snapshot `old`,
+        either a SrcML file or a fact store written with --cache, and
+        write the units and entities added, removed or changed to
+        `output` as JSON lines, by default to a file named after `new`.
+        Returns the output."""
+        if output is None:
+            output = diff_filename(input_name(new), self.compress)
+        stats = self.stats
+        kinds = self.entities
+        accept = UnitFilter(self.paths, self.exclude, self.languages)
+        self.log('Loading',old,'...')
+        with stats.phase('load'):
+            if not hasattr(old, 'read') and is_fact_store(old):
+                old_hashes, old_facts = stored_snapshot(old, accept)
+            else:
+                old_hashes, old_facts = srcml_snapshot(
+                    old, kinds, accept, self.decompress_threads)
+
+        compress = self.compress
+        if compress is None and not hasattr(output, 'write'):
+            compress = output_compression(output)
+        writer = MSEWriter(output, compress=compress,
+                           compress_level=self.compress_level,
+                           threads=self.compress_threads)
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        counts = collections.Counter()
+        def report(change, key, before, after):
+            record = collections.OrderedDict([
+                ('change', change), ('kind', key[0]), ('unit', key[1]),
+                ('key', key[2:])])
+            if before is not None:
+                record['old'] = before
+            if after is not None:
+                record['new'] = after
+            writer.write(encode(record))
+            writer.write('\n')
+            counts[change] += 1
+
+        self.log('Comparing with',new,'...')
+        with stats.phase('diff'):
+            # The entities of the new units that differ, then the facts
+            # of the old units they replace or that were removed
+            seen = set()
+            unchanged = 0
+            differ = collections.OrderedDict()
+            for path, key, unit, xml in snapshot_units(
+                    new, accept, self.decompress_threads):
+                seen.add(path)
+                if old_hashes.get(path) == key:
+                    unchanged += 1
+                    continue
+                differ[path] = (key, fact_entities(unit_facts(unit, xml,
+                                                              kinds), kinds))
+            removed = [path for path in old_hashes if path not in seen]
+            before = old_facts([path for path in differ
+                                if path in old_hashes] + removed)
+            for path, (key, after) in differ.items():
+                if path not in before:
+                    report('added', ('unit', path), None, {'hash': key})
+                    before_entities = {}
+                else:
+                    report('changed', ('unit', path),
+                           {'hash': old_hashes[path]}, {'hash': key})
+                    before_entities = fact_entities(before.pop(path), kinds)
+                for change in diff_entities(before_entities, after):
+                    report(*change)
+            for path in removed:
+                if path not in before:
+                    continue
+                report('removed', ('unit', path), {'hash': old_hashes[path]},
+                       None)
+                for change in diff_entities(
+                        fact_entities(before.pop(path), kinds), {}):
+                    report(*change)
+        writer.close()
+        self.log('Skipped',unchanged,'unchanged units')
+        self.log('Found',counts['added'],'added,',counts['removed'],
+                 'removed and',counts['changed'],'changed entities')
+        stats.count('unchanged_units', unchanged)
+        for change in ('added', 'removed', 'changed'):
+            stats.count(change, counts[change])
+        return output
+
+    def load(self, input):
+        """Read the facts of each unit of a SrcML file name or binary
+        file, compressed or not, one unit at a time."""
+        self.log('Loading',input,'...')
+        stats = self.stats
+        with stats.phase('load'):
+            owned = not hasattr(input, 'read')
+            size = os.path.getsize(input) if owned else None
+            # Progress is measured on the file, before decompression
+            input_file, source = open_input(input, self.decompress_threads)
+            accept = UnitFilter(self.paths, self.exclude, self.languages)
+            units = iter_units(source, accept or None)
+            cache = FactCache(self.cache) if self.cache else None
+            # Cached facts are kept whole, so other runs can use them
+            kinds = entity_kinds if cache is not None else self.entities
+            if self.jobs > 1:
+                facts_iter = parallel_unit_facts(units, self.jobs, cache,
+                                                 kinds)
+            elif cache is not None:
+                facts_iter = cached_unit_facts(units, cache)
+            else:
+                facts_iter = (unit_facts(unit, None, kinds) for unit in units)
+            progress = stats.progress('load', size, 'units')
+            all_facts = FactBuffer(self.max_memory)
+            for facts in facts_iter:
+                all_facts.append(facts)
+                if size:
+                    progress.update(input_file.tell(), len(all_facts))
+            progress.finish()
+            if source is not input_file:
+                source.close()
+            if owned:
+                input_file.close()
+            if cache is not None:
+                cache.close(prune=not accept)
+        if accept:
+            self.log('Skipped',accept.skipped,'units')
+            stats.count('skipped_units', accept.skipped)
+        if cache is not None:
+            self.log('Cache:',cache.hits,'hits,',cache.misses,'misses')
+            stats.count('cache_hits', cache.hits)
+            stats.count('cache_misses', cache.misses)
+        stats.count('spilled_units', all_facts.held)
+        return all_facts
+
+    def resolve_sender(self, sender, path):
+        if sender[0] == 'method':
+            kind, class_key, method_name, method_sig, params = sender
+            cl = self.classes.get(class_key, path)
+        else:
+            (kind, context, signature, class_name, method_name,
+             method_sig, params) = sender
+            f = self.functions.get((context[0], signature))
+            if f is not None:
+                return f
+            if class_name is None:
+                return None
+            cl = self.classes.find(class_name, context, path)
+        if cl is not None:
+            return cl.find_method(method_name, params)
+        return None
+
+    def link(self, all_facts):
+        """Make the FAMIX nodes for the facts of all units, in a
+        FactBuffer, resolving the references between units.  The facts
+        of each unit are released once their nodes are made."""
+        stats = self.stats
+        nodes = self.nodes
+        classes = self.classes
+        functions = self.functions
+        units_by_path = self.units_by_path
+        headers = self.headers
+        siconos = Package(self, self.package)
+        nodes.append(siconos)
+
+        def facts_for(kind):
+            # Facts from the cache have all kinds of entities
+            return all_facts if kind in self.entities else ()
+
+        with stats.phase('units'):
+            for facts in all_facts:
+                path = facts.path
+                lang = facts.language
+                ext = os.path.splitext(path)[1]
+                if ext in ['.h', '.hpp', '.i']:
+                    u = Header(self, path, lang)
+                    headers[u.filepath] = u
+                else:
+                    u = CompilationUnit(self, path, lang)
+                nodes.append(u)
+                units_by_path[u.filepath] = u
+        self.log('Found',len(units_by_path),'units')
+        self.log('Found',len(headers),'headers')
+        stats.count('units', len(units_by_path))
+        stats.count('headers', len(headers))
+
+        # Resolve #include relations
+        with stats.phase('includes'):
+            index = IncludeIndex(units_by_path.values(), self.include_paths)
+            n_includes = 0
+            n_ambiguous_includes = 0
+            n_unresolved_includes = 0
+            for facts in facts_for('includes'):
+                u = units_by_path[facts.path]
+                for fn, angled in facts.includes:
+                    h, ambiguous = index.find(facts.path, fn, angled)
+                    if h is None:
+                        # make node for header marked as external?
+                        n_unresolved_includes += 1
+                        continue
+                    u.add_include(self, h)
+                    n_includes += 1
+                    if ambiguous:
+                        n_ambiguous_includes += 1
+                facts.includes = ()
+        self.log('Resolved',n_includes,'includes')
+        self.log('Resolved',n_ambiguous_includes,
+                 'ambiguous includes to the nearest file')
+        self.log('Could not resolved',n_unresolved_includes,'includes (probably external libs)')
+        stats.count('includes', n_includes)
+        stats.count('ambiguous_includes', n_ambiguous_includes)
+        stats.count('unresolved_includes', n_unresolved_includes)
+        nodes.finish()
+
+        with stats.phase('classes'):
+            for facts in facts_for('classes'):
+                u = units_by_path[facts.path]
+                for cf in facts.classes:
+                    node = Class(self, siconos, cf.name, cf.key, cf.context)
+                    node.add_sourceUnit(self, facts.path, cf.lines)
+                    for s in cf.supers:
+                        node.add_superclass(s)
+                    for (name, signature, ty, arity, lines,
+                         params) in cf.methods:
+                        met = node.add_method(self, name, signature, ty,
+                                              arity, params)
+                        met.add_sourceAnchor(self, u, *lines or (None, None))
+                    for name, typename in cf.variables:
+                        node.add_variable(self, name, typename)
+                    nodes.append(node)
+                    classes.add(node)
+                facts.classes = ()
+
+            # Make inheritance nodes
+            for cl in classes:
+                path = node_path(cl)
+                for s in cl.supers:
+                    superclass = classes.find(s, cl.context, path)
+                    if superclass is not None and superclass is not cl:
+                        cl.add_inheritance(self, superclass)
+        self.log('Found',len(classes),'classes')
+        stats.count('classes', len(classes))
+
+        # Find non-class functions
+        with stats.phase('functions'):
+            for facts in facts_for('functions'):
+                u = units_by_path[facts.path]
+                for (name, signature, tyname, arity, lines,
+                     context) in facts.functions:
+                    key = (context[0], signature)
+                    if key not in functions:
+                        f = Function(self, name, signature, tyname, arity,
+                                     context)
+                        f.add_sourceAnchor(self, u, *lines or (None, None))
+                        functions[key] = f
+                        self.functions_by_name.setdefault(f.name, []).append(f)
+                        nodes.append(f)
+                facts.functions = ()
+        self.log('Found',len(functions),'non-class functions')
+        stats.count('functions', len(functions))
+
+        # Resolve unresolved types
+        with stats.phase('types'):
+            for facts in all_facts:
+                for key, name, target, context in facts.aliases:
+                    self.aliases.add(Alias(key, name, target, context,
+                                           facts.path))
+                facts.aliases = ()
+            types = TypeResolver(classes, self.aliases, self.type_wrappers)
+            # Normalise each distinct spelling once, then resolve
+            spellings = set(n.declaredType for n, context in self.unresolved)
+            for spelling in spellings:
+                types.normalize(spelling)
+            normal = types.normal
+            count = 0
+            for n, context in self.unresolved:
+                owner = (n.classclass if isinstance(n, (Method, Attribute))
+                         else n)
+                cl = types.resolve(normal[n.declaredType], context,
+                                   node_path(owner))
+                if cl is not None:
+                    count += 1
+                    n.declaredType = cl
+        self.log('Found',len(self.aliases),'type aliases')
+        self.log('Resolved',count,'types')
+        stats.count('aliases', len(self.aliases))
+        stats.count('types', len(self.unresolved))
+        stats.count('type_spellings', len(spellings))
+        stats.count('resolved_types', count)
+        # Types were the last change to classes, methods and functions
+        nodes.finish()
+
+        # Find function calls
+        with stats.phase('calls'):
+            progress = stats.progress('calls', len(all_facts), 'calls')
+            edges = {}
+            resolver = None
+            if self.resolve_calls or self.aggregate_calls:
+                resolver = CallResolver(classes, self.functions_by_name)
+            n_calls = 0
+            n_resolved = 0
+            units = (all_facts.calls() if 'invocations' in self.entities
+                     else ())
+            for i, (facts, calls) in enumerate(units):
+                progress.update(i, n_calls)
+                n_calls += len(calls)
+                u = units_by_path[facts.path]
+                for signature, sender, callee, nargs, lines in calls:
+                    sender = self.resolve_sender(sender, facts.path)
+                    if not sender:
+                        continue
+                    if self.aggregate_calls:
+                        # One edge per sender and receiver, or per
+                        # sender, name called and number of arguments
+                        # if the receiver is not found
+                        receiver = resolver.resolve(sender, callee, nargs)
+                        if receiver is not None:
+                            key = (sender, receiver)
+                        else:
+                            key = (sender, callee, nargs)
+                        inv = edges.get(key)
+                        if inv is not None:
+                            inv.count += 1
+                            continue
+                        inv = edges[key] = Invocation(
+                            self, signature=signature, sender=sender,
+                            receiver=receiver, count=1)
+                    else:
+                        inv = Invocation(self, signature=signature,
+                                         sender=sender)
+                        if resolver is not None:
+                            inv.receiver = resolver.resolve(sender, callee,
+                                                            nargs)
+                    inv.add_sourceAnchor(self, u, *lines or (None, None))
+                    if inv.receiver is not None:
+                        n_resolved += 1
+                    self.n_invocations += 1
+                    nodes.append(inv)
+                if not self.aggregate_calls:
+                    nodes.finish()
+            progress.finish()
+            nodes.finish()
+        self.log('Found',self.n_invocations,'invocations')
+        if resolver is not None:
+            self.log('Resolved',n_resolved,'invocation receivers')
+            stats.count('receivers', n_resolved)
+        stats.count('calls', n_calls)
+        stats.count('invocations', self.n_invocations)
+
+    def write(self, output, format=None, compress=None):
+        """Write the model to a file name or binary file in one of the
+        `exporters` formats, by default the converter's.  Output is
+        compressed in the format named by `compress`, by default the
+        converter's, or the one shown by the file name."""
+        exporter = exporters[format or self.format]
+        if compress is None:
+            compress = self.compress
+        if compress is None and not hasattr(output, 'write'):
+            compress = output_compression(output)
+        if not exporter.compressible:
+            compress = None
+        output_file = exporter(output, compress=compress,
+                               compress_level=self.compress_level,
+                               threads=self.compress_threads)
+        progress = self.stats.progress('output', len(self.nodes), 'nodes')
+        for i, n in enumerate(self.nodes):
+            if not i & 0xfff:
+                progress.update(i, i)
+            output_file.write_node(n)
+        output_file.close()
+        progress.finish()
+
+def convert(input, output=None, package='Siconos', **options):
+    """Convert a SrcML file to MSE, see Converter for the options."""
+    return Converter(package=package, **options).convert(input, output)
+
+# Batch mode.  Each worker process keeps one Converter, so the modules
+# and compiled XPath expressions are loaded once and reused for every
+# input it converts.
+
+batch_converter = None
+batch_memory_limit = None
+
+def init_batch_worker(options, memory_limit):
+    global batch_converter, batch_memory_limit
+    # Interrupting the batch lets the workers finish their input
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    batch_converter = Converter(verbose=False, **options)
+    batch_memory_limit = memory_limit
+
+@contextlib.contextmanager
+def memory_budget(limit):
+    """Limit the address space of this process to `limit` bytes, so
+    that an input too large for its budget fails, see memory_failure(),
+    instead of taking the memory of the other workers."""
+    if limit is None or resource is None:
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+def memory_failure(e):
+    """Whether an error raised under a memory budget comes from running
+    out of it.  Allocations failing inside lxml and other C code give
+    SystemError or a parser error rather than MemoryError."""
+    return (isinstance(e, (MemoryError, SystemError))
+            or (isinstance(e, etree.LxmlError)
+                and 'Memory allocation failed' in str(e)))
+
+def batch_convert(input, output):
+    """Convert one input in a batch worker, returning its record for
+    the results index."""
+    converter = batch_converter
+    converter.stats = PhaseStats()
+    record = collections.OrderedDict([('input', input), ('output', output),
+                                      ('status', 'ok')])
+    start = time.time()
+    try:
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with memory_budget(batch_memory_limit):
+            converter.convert(input, output)
+    except MemoryError:
+        record['status'] = 'memory'
+        record['error'] = 'memory budget exceeded'
+    except Exception as e:
+        error = '%s: %s'%(type(e).__name__, e)
+        if batch_memory_limit is not None and memory_failure(e):
+            record['status'] = 'memory'
+            record['error'] = 'memory budget exceeded, %s'%error
+        else:
+            record['status'] = 'error'
+            record['error'] = error
+    finally:
+        # Free the model before the next input
+        converter.reset()
+    if record['status'] != 'ok' and os.path.exists(output):
+        os.remove(output)
+    record['seconds'] = time.time() - start
+    record['peak_rss'] = peak_rss()
+    record['phases'] = collections.OrderedDict(
+        (name, p['seconds']) for name, p in converter.stats.phases.items())
+    record['counts'] = converter.stats.counts
+    record['worker'] = os.getpid()
+    record['date'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    return record
+
+srcml_suffixes = ('.xml',) + tuple('.xml' + s for s in compressed_suffixes)
+
+class Refused(object):
+    """The record of an input that was not converted, in place of the
+    result of a worker."""
+    def __init__(self, record):
+        self.record = record
+    def ready(self):
+        return True
+    def wait(self):
+        pass
+    def get(self):
+        return self.record
+
+class Batch(object):
+    """Convert many SrcML files on a fixed pool of worker processes, and
+    append a record of each conversion, with its timings and entity
+    counts, to a JSON Lines results index.  The options are those of
+    Converter, except that each input is converted by a single process.
+
+    With `output_dir`, each output keeps the directory of its input
+    relative to the manifest or watched directory, so that inputs with
+    the same name do not overwrite each other.  An input whose output
+    is that of another input is refused."""
+
+    def __init__(self, workers=1, output_dir=None, index=None,
+                 memory_limit=None, verbose=True, **options):
+        options['jobs'] = 1
+        self.workers = workers or multiprocessing.cpu_count()
+        self.output_dir = output_dir
+        self.compress = options.get('compress')
+        self.format = options.get('format', 'mse')
+        self.index = open(index, 'a') if index else None
+        self.verbose = verbose
+        self.pool = multiprocessing.Pool(self.workers, init_batch_worker,
+                                         (options, memory_limit))
+        self.pending = collections.deque()
+        self.outputs = {}    # output -> input
+        self.converted = 0
+        self.failed = 0
+
+    def log(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def output(self, input, base=''):
+        """The output of an input, `base` being the directory its path
+        is relative to under `output_dir`."""
+        output = output_filename(input, self.compress, self.format)
+        if self.output_dir is not None:
+            relative = os.path.relpath(output, base or os.curdir)
+            if relative.split(os.sep)[0] == os.pardir:
+                relative = os.path.basename(output)
+            output = os.path.join(self.output_dir, relative)
+        return output
+
+    def submit(self, input, base=''):
+        output = self.output(input, base)
+        key = os.path.abspath(output)
+        other = self.outputs.setdefault(key, input)
+        if other != input:
+            self.pending.append(Refused(collections.OrderedDict([
+                ('input', input), ('output', output), ('status', 'error'),
+                ('error', 'output is that of %s'%other)])))
+            return
+        self.pending.append(self.pool.apply_async(
+            batch_convert, (input, output)))
+
+    def collect(self, wait=False):
+        """Record the conversions that have finished, in the order they
+        were submitted, waiting for all of them if `wait` is set."""
+        while self.pending and (wait or self.pending[0].ready()):
+            record = self.pending.popleft().get()
+            if record['status'] == 'ok':
+                self.converted += 1
+                self.log('Converted', record['input'], 'in',
+                         '%.2f s'%record['seconds'])
+            else:
+                self.failed += 1
+                self.log('Failed', record['input'] + ':', record['error'])
+            if self.index is not None:
+                self.index.write(json.dumps(record) + '\n')
+                self.index.flush()
+
+    def run(self, inputs, base=''):
+        """Convert each of `inputs`, with at most a few inputs waiting
+        for each worker."""
+        for input in inputs:
+            self.submit(input, base)
+            while len(self.pending) > 2*self.workers:
+                self.pending[0].wait()
+                self.collect()
+        self.collect(wait=True)
+
+    def watch(self, directory, interval=5.0):
+        """Convert the SrcML files that appear in `directory`, until
+        interrupted.  A file is converted once its size has stopped
+        changing, and again whenever it is modified, unless its output
+        is already newer than it."""
+        sizes = {}
+        done = {}
+        while True:
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(srcml_suffixes):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if done.get(path) == st.st_mtime:
+                    continue
+                if sizes.get(path) != st.st_size:
+                    # Wait until it has been written
+                    sizes[path] = st.st_size
+                    continue
+                done[path] = st.st_mtime
+                output = self.output(path, directory)
+                if (os.path.exists(output)
+                    and os.path.getmtime(output) >= st.st_mtime):
+                    continue
+                self.submit(path, directory)
+            self.collect()
+            time.sleep(interval)
+
+    def close(self):
+        self.collect(wait=True)
+        self.pool.close()
+        self.pool.join()
+        if self.index is not None:
+            self.index.close()
+
+def read_manifest(filename):
+    """The inputs listed in a manifest, one per line, ignoring blank
+    lines and comments starting with #.  Relative paths are relative to
+    the manifest, and "-" reads the list from stdin."""
+    f = sys.stdin if filename == '-' else open(filename)
+    base = '' if filename == '-' else os.path.dirname(filename)
+    try:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield os.path.join(base, line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def entity_list(value):
+    kinds = [k.strip() for k in value.split(',') if k.strip()]
+    unknown = [k for k in kinds if k not in entity_kinds]
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown entity kind %s, choose '
+                                         'from %s'%(', '.join(unknown),
+                                         ', '.join(sorted(entity_kinds))))
+    return kinds
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert SrcML output for C++ code to MSE.')
+    parser.add_argument('input', nargs='?', default='siconos-srcml.xml.bz2',
+                        help='SrcML file, optionally compressed with bzip2, '
+                        'gzip, xz or zstd')
+    parser.add_argument('--package', default='Siconos',
+                        help='name of the FAMIX package')
+    parser.add_argument('--format', choices=list(exporters), default='mse',
+                        help='output format: MSE, JSON lines, SQLite or '
+                        'binary columnar')
+    parser.add_argument('--aggregate-calls', action='store_true',
+                        help='make one invocation for all the calls from '
+                        'a sender to the same function or method, with '
+                        'their count')
+    parser.add_argument('--resolve-calls', action='store_true',
+                        help='find the function or method called by each '
+                        'invocation, given as its receiver')
+    parser.add_argument('--type-wrapper', dest='type_wrappers',
+                        action='append', default=[], metavar='NAME',
+                        help='template holding the type of a variable, like '
+                        'shared_ptr, or namespace ending with :: like SP::')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes reading units '
+                        '(0 for one per CPU)')
+    parser.add_argument('-I', dest='include_paths', action='append',
+                        default=[], metavar='DIR',
+                        help='search path for #include, as it appears in '
+                        'the file names of the SrcML units')
+    parser.add_argument('--compress', choices=list(compressions) + ['none'],
+                        help='compression of the output, by default bzip2 '
+                        'if the input is compressed')
+    parser.add_argument('--compress-level', type=int, default=9,
+                        choices=range(1, 10), metavar='{1..9}',
+                        help='compression level of the output')
+    parser.add_argument('--compress-threads', type=int, default=0,
+                        metavar='N', help='compress the output in N '
+                        'background threads')
+    parser.add_argument('--decompress-threads', type=int, default=0,
+                        metavar='N', help='threads decompressing input made '
+                        'of several bzip2 or zstd streams (0 for one per '
+                        'CPU)')
+    parser.add_argument('--path', dest='paths', action='append', default=[],
+                        metavar='GLOB', help='convert only the units whose '
+                        'path matches GLOB, such as "src/core/*"')
+    parser.add_argument('--exclude', action='append', default=[],
+                        metavar='GLOB', help='skip the units whose path '
+                        'matches GLOB')
+    parser.add_argument('--language', dest='languages', action='append',
+                        default=[], metavar='LANG',
+                        help='convert only the units in LANG (C, C++, SWIG, '
+                        'Java...)')
+    parser.add_argument('--entities', type=entity_list,
+                        default=sorted(entity_kinds), metavar='KINDS',
+                        help='comma-separated kinds of entities to extract, '
+                        'among %s (invocations bring classes and functions)'
+                        %', '.join(sorted(entity_kinds)))
+    parser.add_argument('--diff', metavar='OLD',
+                        help='compare the input with an earlier SrcML file '
+                        'or fact store, and write the changes as JSON lines')
+    parser.add_argument('--max-memory', type=int, metavar='MB',
+                        help='spill calls and finished nodes to temporary '
+                        'files when the conversion uses more than MB '
+                        'megabytes')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='database of unit facts, only units that '
+                        'changed since the last run are read again')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='save the time and memory used by each phase '
+                        'as JSON')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='profile each phase with cProfile, print the '
+                        'hot spots and save the profile to FILE')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace Python allocations in each phase with '
+                        'tracemalloc (slow)')
+    parser.add_argument('--progress', action='store_true',
+                        help='show the progress of long phases on stderr')
+    batch = parser.add_argument_group(
+        'batch mode', 'convert many SrcML files on a pool of workers')
+    batch.add_argument('--manifest', metavar='FILE',
+                       help='convert the files listed in FILE, one per '
+                       'line ("-" for stdin)')
+    batch.add_argument('--watch', metavar='DIR',
+                       help='convert SrcML files as they appear in DIR, '
+                       'until interrupted')
+    batch.add_argument('--poll', type=float, default=5.0, metavar='SECONDS',
+                       help='how often to look for new files in DIR')
+    batch.add_argument('--workers', type=int, default=1, metavar='N',
+                       help='number of inputs converted at a time '
+                       '(0 for one per CPU)')
+    batch.add_argument('--output-dir', metavar='DIR',
+                       help='write the MSE files to DIR, under the '
+                       'directory of their input relative to the manifest, '
+                       'instead of next to their input')
+    batch.add_argument('--index', metavar='FILE',
+                       help='append the timings and entity counts of each '
+                       'conversion to FILE, as JSON lines')
+    batch.add_argument('--memory-limit', type=int, metavar='MB',
+                       help='memory budget of each conversion, inputs '
+                       'needing more fail')
+    args = parser.parse_args(argv)
+    max_memory = args.max_memory and args.max_memory*1024*1024
+
+    if args.diff and args.cache:
+        parser.error('--cache cannot be used with --diff, give the fact '
+                     'store as OLD instead')
+    if args.manifest or args.watch:
+        if args.cache:
+            parser.error('--cache cannot be used in batch mode')
+        if args.diff:
+            parser.error('--diff cannot be used in batch mode')
+        memory_limit = args.memory_limit and args.memory_limit*1024*1024
+        runner = Batch(workers=args.workers, output_dir=args.output_dir,
+                       index=args.index, memory_limit=memory_limit,
+                       package=args.package,
+                       include_paths=args.include_paths,
+                       compress=args.compress,
+                       compress_level=args.compress_level,
+                       compress_threads=args.compress_threads,
+                       decompress_threads=args.decompress_threads,
+                       format=args.format,
+                       aggregate_calls=args.aggregate_calls,
+                       resolve_calls=args.resolve_calls,
+                       type_wrappers=args.type_wrappers,
+                       max_memory=max_memory, paths=args.paths,
+                       exclude=args.exclude, languages=args.languages,
+                       entities=args.entities)
+        try:
+            if args.manifest:
+                base = ('' if args.manifest == '-'
+                        else os.path.dirname(args.manifest))
+                runner.run(read_manifest(args.manifest), base)
+            else:
+                runner.watch(args.watch, args.poll)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            runner.close()
+        print('Converted', runner.converted, 'files,', runner.failed,
+              'failed')
+        return 1 if runner.failed else 0
+
+    stats = PhaseStats()
+    stats.profile = bool(args.profile)
+    stats.trace_memory = args.trace_memory
+    stats.show_progress = args.progress
+
+    converter = Converter(package=args.package,
+                          include_paths=args.include_paths,
+                          jobs=args.jobs, cache=args.cache,
+                          compress=args.compress,
+                          compress_level=args.compress_level,
+                          compress_threads=args.compress_threads,
+                          decompress_threads=args.decompress_threads,
+                          format=args.format,
+                          aggregate_calls=args.aggregate_calls,
+                          resolve_calls=args.resolve_calls,
+                          type_wrappers=args.type_wrappers,
+                          max_memory=max_memory, paths=args.paths,
+                          exclude=args.exclude, languages=args.languages,
+                          entities=args.entities, stats=stats)
+    if args.diff:
+        converter.diff(args.diff, args.input)
+    else:
+        converter.convert(args.input)
+
+    if args.profile:
+        stats.report()
+        stats.save_profile(args.profile)
+    if args.stats:
+        stats.save(args.stats)
+
+if __name__ == '__main__':
+    sys.exit(main())